@@ -0,0 +1,180 @@
+import time
+import asyncio
+import metrics
+from collections import OrderedDict
+from google import genai
+from google.genai import types
+
+
+def normalize_prompt(prompt):
+    """Normalize a prompt so trivially different spellings share a cache entry."""
+    return " ".join(prompt.casefold().split())
+
+
+class ResponseCache:
+    """LRU cache of AI responses whose entries also expire after ttl seconds."""
+
+    def __init__(self, max_entries=512, ttl=60 * 60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires_at, text), least recently used first
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return a cached response, or None if it is missing or expired."""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, text):
+        """Cache a response, evicting the least recently used entries over the limit."""
+        self._entries[key] = (time.monotonic() + self.ttl, text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class GeminiBackend:
+    """Sends prompts to Gemini through one shared google-genai async client."""
+
+    def __init__(self, api_key, model="gemini-2.0-flash"):
+        self.api_key = api_key
+        self.model = model
+        self._client = None
+
+    @property
+    def client(self):
+        # Built on first use so the bot can start without a Gemini key configured
+        if self._client is None:
+            self._client = genai.Client(api_key=self.api_key)
+        return self._client
+
+    def create_chat(self, history=()):
+        """Start a conversation, optionally seeded with (role, text) turns."""
+        contents = [types.Content(role=role, parts=[types.Part(text=text)]) for role, text in history]
+        return self.client.aio.chats.create(model=self.model, history=contents)
+
+    async def stream(self, chat, prompt):
+        """Send a prompt on a conversation and yield the reply text as it is generated."""
+        async for chunk in await chat.send_message_stream(prompt):
+            if chunk.text:
+                yield chunk.text
+
+
+class StubBackend:
+    """Local stand-in for GeminiBackend that answers after a fixed delay, for tests and benchmarks."""
+
+    def __init__(self, latency=0.0, reply=lambda history, prompt: f"You said: {prompt}", chunk_size=16, chunk_latency=0.0):
+        self.latency = latency  # Delay before the first chunk
+        self.chunk_latency = chunk_latency  # Delay between later chunks
+        self.chunk_size = chunk_size
+        self.reply = reply
+        self.calls = 0
+
+    def create_chat(self, history=()):
+        """Start a conversation, kept as a plain list of (role, text) turns."""
+        return list(history)
+
+    async def stream(self, chat, prompt):
+        """Record the prompt and yield the canned reply a few characters at a time."""
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        text = self.reply(chat, prompt)
+        for start in range(0, len(text), self.chunk_size):
+            if start:
+                await asyncio.sleep(self.chunk_latency)
+            yield text[start:start + self.chunk_size]
+        chat.extend([("user", prompt), ("model", text)])
+
+
+class _Session:
+    __slots__ = ("chat", "lock", "last_used")
+
+    def __init__(self):
+        self.chat = None
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+
+
+class AIClient:
+    """Answers prompts with per-channel conversations, a concurrency limit and a response cache.
+
+    Only prompts that start a new conversation are cached, since a reply in the middle
+    of a conversation depends on what was said before it.
+    """
+
+    def __init__(self, backend, max_concurrency=4, cache=None, session_ttl=15 * 60, max_sessions=1000):
+        self.backend = backend
+        self.cache = cache or ResponseCache()
+        self.session_ttl = session_ttl
+        self.max_sessions = max_sessions
+        self._limiter = asyncio.Semaphore(max_concurrency)
+        self._sessions = OrderedDict()  # channel_id -> _Session, least recently used first
+        self._inflight = {}  # prompt key -> Future for uncached prompts already being answered
+
+    def _session(self, channel_id):
+        """Return the channel's conversation, starting a new one if it went idle."""
+        now = time.monotonic()
+        session = self._sessions.get(channel_id)
+        if session is None or session.last_used + self.session_ttl <= now:
+            session = self._sessions[channel_id] = _Session()
+        session.last_used = now
+        self._sessions.move_to_end(channel_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return session
+
+    async def stream(self, channel_id, prompt):
+        """Yield the AI's reply to a prompt sent in a channel as it is generated."""
+        key = normalize_prompt(prompt)
+        session = self._session(channel_id)
+        async with session.lock:
+            fresh = session.chat is None
+            if fresh:
+                cached = self.cache.get(key)
+                if cached is None and key in self._inflight:
+                    # The same prompt is already being answered for another channel
+                    try:
+                        cached = await asyncio.shield(self._inflight[key])
+                    except Exception:
+                        cached = None
+                if cached is not None:
+                    # Seed the conversation so follow-up prompts still have the context
+                    session.chat = self.backend.create_chat([("user", prompt), ("model", cached)])
+                    yield cached
+                    return
+                session.chat = self.backend.create_chat()
+                future = self._inflight[key] = asyncio.get_running_loop().create_future()
+
+            pieces = []
+            try:
+                async with self._limiter:
+                    started = time.perf_counter()
+                    async for piece in self.backend.stream(session.chat, prompt):
+                        if not pieces:
+                            metrics.observe("ai_first_token_seconds", time.perf_counter() - started)
+                        pieces.append(piece)
+                        yield piece
+                    metrics.observe("external_call_seconds", time.perf_counter() - started, service="gemini")
+            except BaseException as e:
+                if fresh:
+                    session.chat = None
+                    self._inflight.pop(key, None)
+                    future.set_exception(e if isinstance(e, Exception) else RuntimeError("AI response was cancelled"))
+                    future.exception()  # Mark retrieved so an unawaited failure isn't logged
+                raise
+
+            if fresh:
+                text = "".join(pieces)
+                self.cache.put(key, text)
+                self._inflight.pop(key, None)
+                future.set_result(text)
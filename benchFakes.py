@@ -0,0 +1,692 @@
+"""Local stand-ins for Discord, yt-dlp, spotipy, google-genai and Wikipedia.
+
+install() puts fake modules into sys.modules so bot.py can be imported and its
+handlers driven without any network access. Every external call sleeps for a
+configurable latency: blocking libraries (yt-dlp, spotipy, wikipedia) block the
+calling thread like the real ones, so a call made on the event loop shows up as
+a loop stall in the benchmark.
+"""
+import sys
+import time
+import types
+import asyncio
+import itertools
+import threading
+import traceback
+
+_ids = itertools.count(1_000_000)
+
+
+class Latency:
+    """Simulated latencies, in seconds, for each external service."""
+
+    def __init__(self, ytdlp=0.3, ytdlp_page=0.2, spotify=0.15, wikipedia=0.2, discord=0.03, track_length=0.5):
+        self.ytdlp = ytdlp  # One yt-dlp search or video extraction
+        self.ytdlp_page = ytdlp_page  # One page of a flat playlist listing
+        self.spotify = spotify  # One Spotify Web API call
+        self.wikipedia = wikipedia  # One Wikipedia API call
+        self.discord = discord  # One Discord REST call (send, edit, defer)
+        self.track_length = track_length  # How long each fake song plays
+
+
+latency = Latency()
+
+
+# --- discord -----------------------------------------------------------------
+
+class Intents:
+    message_content = False
+
+    @classmethod
+    def default(cls):
+        return cls()
+
+
+class Color:
+    def __init__(self, value=0):
+        self.value = value
+
+
+for _name in ("gold", "green", "red", "blue", "purple", "orange", "dark_teal"):
+    setattr(Color, _name, classmethod(lambda cls: cls()))
+
+
+class Embed:
+    def __init__(self, title=None, description=None, color=None):
+        self.title = title
+        self.description = description
+        self.color = color
+        self.fields = []
+        self.thumbnail = self.image = self.footer = None
+
+    def add_field(self, name, value, inline=True):
+        self.fields.append((name, value))
+        return self
+
+    def set_thumbnail(self, url=None):
+        self.thumbnail = url
+        return self
+
+    def set_image(self, url=None):
+        self.image = url
+        return self
+
+    def set_footer(self, text=None, icon_url=None):
+        self.footer = text
+        return self
+
+
+class ClientException(Exception):
+    pass
+
+
+class AudioSource:
+    def read(self):
+        return b""
+
+    def is_opus(self):
+        return False
+
+    def cleanup(self):
+        pass
+
+
+class FFmpegPCMAudio(AudioSource):
+    def __init__(self, source, before_options=None, options=None, **kwargs):
+        self.source = source
+
+
+class FFmpegOpusAudio(AudioSource):
+    def __init__(self, source, codec=None, before_options=None, options=None, **kwargs):
+        self.source = source
+
+    def is_opus(self):
+        return True
+
+
+class OggStream:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def iter_packets(self):
+        return iter(())
+
+
+class PCMVolumeTransformer(AudioSource):
+    def __init__(self, original, volume=1.0):
+        self.original = original
+        self.volume = volume
+
+
+def utils_get(iterable, **attrs):
+    for item in iterable:
+        if all(getattr(item, name) == value for name, value in attrs.items()):
+            return item
+    return None
+
+
+class Interaction:
+    pass
+
+
+class User:
+    pass
+
+
+class TextChannel:
+    pass
+
+
+class _Command:
+    def __init__(self, name):
+        self.name = self.qualified_name = name
+
+
+class CommandTree:
+    def __init__(self, client):
+        self.client = client
+        self.commands = {}
+
+    def command(self, name, description=None, **kwargs):
+        def register(callback):
+            self.commands[name] = callback
+            return callback
+        return register
+
+    async def sync(self):
+        return list(self.commands)
+
+    async def interaction_check(self, interaction):
+        return True
+
+    async def on_error(self, interaction, error):
+        traceback.print_exception(type(error), error, error.__traceback__)
+
+    async def invoke(self, interaction, name, **options):
+        """Run a slash command the way discord.py dispatches one."""
+        command = interaction.command = _Command(name)
+        if not await self.interaction_check(interaction):
+            return
+        try:
+            await self.commands[name](interaction, **options)
+        except Exception as e:
+            await self.on_error(interaction, e)
+            return
+        await self.client.dispatch("app_command_completion", interaction, command)
+
+
+def describe(**parameters):
+    return lambda callback: callback
+
+
+def default_permissions(**permissions):
+    return lambda callback: callback
+
+
+class Range:
+    def __class_getitem__(cls, item):
+        return item[0] if isinstance(item, tuple) else item
+
+
+class Bot:
+    def __init__(self, command_prefix=None, intents=None, tree_cls=CommandTree, **kwargs):
+        self.tree = tree_cls(self)
+        self.voice_clients = []
+        self.guilds = []
+        self.latency = latency.discord
+        self.user = "BenchBot#0001"
+        self.events = {}
+
+    def event(self, callback):
+        self.events[callback.__name__] = callback
+        return callback
+
+    async def dispatch(self, name, *args):
+        callback = self.events.get(f"on_{name}")
+        if callback is not None:
+            await callback(*args)
+
+    async def process_commands(self, message):
+        pass
+
+    def get_guild(self, guild_id):
+        return next((guild for guild in self.guilds if guild.id == guild_id), None)
+
+    def run(self, token):
+        raise RuntimeError("The benchmark fakes can't connect to Discord")
+
+
+class AutoShardedBot(Bot):
+    def __init__(self, command_prefix=None, intents=None, tree_cls=CommandTree, shard_count=None, shard_ids=None, **kwargs):
+        super().__init__(command_prefix, intents, tree_cls, **kwargs)
+        self.shard_count = shard_count
+        self.shard_ids = shard_ids if shard_ids is not None else list(range(shard_count or 1))
+
+    @property
+    def latencies(self):
+        return [(shard_id, self.latency) for shard_id in self.shard_ids]
+
+
+class _Loop:
+    """Minimal discord.ext.tasks.Loop."""
+
+    def __init__(self, callback, seconds):
+        self.callback = callback
+        self.seconds = seconds
+        self._task = None
+
+    def is_running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+        return self._task
+
+    def cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            await self.callback()
+            await asyncio.sleep(self.seconds)
+
+
+def tasks_loop(seconds=0, **kwargs):
+    return lambda callback: _Loop(callback, seconds)
+
+
+# --- fake Discord objects handed to the handlers -------------------------------
+
+class FakeAvatar:
+    url = "https://cdn.discordapp.com/embed/avatars/0.png"
+
+
+class SentMessage:
+    def __init__(self, owner, content=None, embed=None):
+        self.owner = owner
+        self.content = content
+        self.embed = embed
+        self.edits = 0
+
+    async def edit(self, content=None, embed=None):
+        await asyncio.sleep(latency.discord)
+        self.content = content
+        self.edits += 1
+        self.owner.record(self)
+
+
+class FakeTextChannel:
+    def __init__(self, guild, name="general"):
+        self.id = next(_ids)
+        self.guild = guild
+        self.name = name
+        self.mention = f"<#{self.id}>"
+        self.sent = []
+        self.listeners = []  # Callables notified with each sent message
+
+    def record(self, message):
+        for listener in self.listeners:
+            listener(message)
+
+    async def send(self, content=None, embed=None, **kwargs):
+        await asyncio.sleep(latency.discord)
+        message = SentMessage(self, content, embed)
+        self.sent.append(message)
+        self.record(message)
+        return message
+
+
+class FakeVoiceState:
+    def __init__(self, channel):
+        self.channel = channel
+        self.self_mute = self.self_deaf = self.mute = self.deaf = False
+
+
+class FakeVoiceClient:
+    """Plays each source for latency.track_length seconds on a timer thread, like discord's audio thread."""
+
+    def __init__(self, client, channel):
+        self.client = client
+        self.channel = channel
+        self.guild = channel.guild
+        self.plays = 0
+        self.gaps = []  # Seconds between one song ending and the next one starting
+        self._timer = None
+        self._after = None
+        self._source = None
+        self._ended_at = None
+        self._connected = True
+
+    def is_playing(self):
+        return self._timer is not None
+
+    def is_paused(self):
+        return False
+
+    def is_connected(self):
+        return self._connected
+
+    def play(self, source, after=None):
+        if self._timer is not None:
+            raise ClientException("Already playing audio.")
+        if self._ended_at is not None:
+            self.gaps.append(time.perf_counter() - self._ended_at)
+        self.plays += 1
+        self._source = source
+        self._after = after
+        self._timer = threading.Timer(latency.track_length, self._finish)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _finish(self):
+        self._timer = None
+        self._ended_at = time.perf_counter()
+        after, self._after = self._after, None
+        source, self._source = self._source, None
+        if after is not None:
+            after(None)
+        if source is not None:
+            source.cleanup()
+
+    def stop(self):
+        timer = self._timer
+        if timer is not None:
+            timer.cancel()
+            threading.Thread(target=self._finish, daemon=True).start()
+
+    async def disconnect(self, **kwargs):
+        self._connected = False
+        self.stop()
+        if self in self.client.voice_clients:
+            self.client.voice_clients.remove(self)
+
+
+class FakeVoiceChannel:
+    def __init__(self, client, guild, name="Music"):
+        self.id = next(_ids)
+        self.client = client
+        self.guild = guild
+        self.name = name
+        self.voice_states = {}
+
+    async def connect(self, **kwargs):
+        if any(vc.guild is self.guild for vc in self.client.voice_clients):
+            raise ClientException("Already connected to a voice channel.")
+        await asyncio.sleep(latency.discord)
+        voice_client = FakeVoiceClient(self.client, self)
+        self.client.voice_clients.append(voice_client)
+        return voice_client
+
+
+class FakeMember:
+    def __init__(self, guild, name=None):
+        self.id = next(_ids)
+        self.guild = guild
+        self.name = self.display_name = name or f"user{self.id}"
+        self.mention = f"<@{self.id}>"
+        self.bot = False
+        self.avatar = FakeAvatar()
+        self.voice = None
+
+    def __str__(self):
+        return self.name
+
+
+class FakeGuild:
+    def __init__(self, client, members=10, guild_id=None):
+        self.id = guild_id or next(_ids)
+        self.name = f"Guild {self.id}"
+        self.afk_channel = None
+        self.text_channels = [FakeTextChannel(self)]
+        self.voice_channels = [FakeVoiceChannel(client, self)]
+        self.stage_channels = []
+        self.members = [FakeMember(self) for _ in range(members)]
+        self._members = {member.id: member for member in self.members}
+        self._channels = {channel.id: channel for channel in self.text_channels + self.voice_channels}
+
+    def get_member(self, user_id):
+        return self._members.get(user_id)
+
+    def get_channel(self, channel_id):
+        return self._channels.get(channel_id)
+
+    def join_voice(self, member):
+        channel = self.voice_channels[0]
+        member.voice = channel.voice_states[member.id] = FakeVoiceState(channel)
+        return member.voice
+
+
+def gateway_guilds(client, count, members, shard_count=0, shard_ids=None):
+    """Make the guilds a fake gateway would deliver to a client running the given shards.
+
+    Guild IDs are the same in every process, so several shard processes together
+    see each of the count guilds exactly once.
+    """
+    guild_ids = [(index + 1) << 22 for index in range(count)]
+    if shard_count and shard_ids is not None:
+        guild_ids = [guild_id for guild_id in guild_ids if (guild_id >> 22) % shard_count in shard_ids]
+    return [FakeGuild(client, members=members, guild_id=guild_id) for guild_id in guild_ids]
+
+
+class FakeMessage:
+    def __init__(self, author, channel, content="hello"):
+        self.author = author
+        self.guild = author.guild
+        self.channel = channel
+        self.content = content
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.deferred = False
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def defer(self, **kwargs):
+        await asyncio.sleep(latency.discord)
+        self.deferred = self._done = True
+
+    async def send_message(self, content=None, embed=None, **kwargs):
+        await asyncio.sleep(latency.discord)
+        self._done = True
+        self.interaction.record(SentMessage(self.interaction, content, embed))
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, embed=None, wait=False, **kwargs):
+        await asyncio.sleep(latency.discord)
+        message = SentMessage(self.interaction, content, embed)
+        self.interaction.record(message)
+        return message if wait else None
+
+
+class FakeInteraction:
+    """A slash command invocation; records when the user first sees a reply."""
+
+    def __init__(self, member, channel):
+        self.user = member
+        self.guild = member.guild
+        self.channel = channel
+        self.channel_id = channel.id
+        self.extras = {}
+        self.command = None
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.created = time.perf_counter()
+        self.first_reply = None
+        self.replies = []
+
+    def record(self, message):
+        if self.first_reply is None:
+            self.first_reply = time.perf_counter()
+        self.replies.append(message)
+
+
+# --- yt-dlp --------------------------------------------------------------------
+
+def _video(video_id, title=None):
+    return {
+        'id': video_id,
+        'title': title or f"Video {video_id}",
+        'url': f"https://rr1---sn-fake.googlevideo.com/videoplayback?id={video_id}&expire={int(time.time()) + 6 * 3600}",
+        'webpage_url': f"https://www.youtube.com/watch?v={video_id}",
+        'thumbnail': f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg",
+        'duration': 180,
+    }
+
+
+class DownloadError(Exception):
+    pass
+
+
+class YoutubeDL:
+    """Fake yt_dlp.YoutubeDL. Playlist URLs (with list=N) list N flat entries in pages of 100."""
+
+    calls = 0
+
+    def __init__(self, params=None):
+        self.params = params or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        pass
+
+    def extract_info(self, url, download=False, process=True):
+        YoutubeDL.calls += 1
+        if "list=" in url:
+            size = int(url.split("list=")[1].split("&")[0])
+            return {'_type': 'playlist', 'id': f"PL{size}", 'title': f"Playlist of {size}",
+                    'entries': self._entries(size)}
+        time.sleep(latency.ytdlp)
+        if url.startswith(("http://", "https://")):
+            video_id = url.rsplit("=", 1)[-1].rsplit("/", 1)[-1]
+        else:
+            video_id = f"s{abs(hash(url)) % 10 ** 8}"
+        info = _video(video_id, title=None if url.startswith("http") else url)
+        if not process:
+            info = {key: value for key, value in info.items() if key != 'url'}
+            info['_type'] = 'video'
+        return info
+
+    def process_ie_result(self, info, download=False):
+        time.sleep(latency.ytdlp)
+        return _video(info['id'], info.get('title'))
+
+    def _entries(self, size):
+        for start in range(0, size, 100):
+            time.sleep(latency.ytdlp_page)
+            for index in range(start, min(start + 100, size)):
+                video_id = f"pl{size}x{index}"
+                yield {'_type': 'url', 'id': video_id, 'title': f"Playlist song {index}",
+                       'url': f"https://www.youtube.com/watch?v={video_id}"}
+
+
+# --- spotipy -------------------------------------------------------------------
+
+def _spotify_track(index):
+    return {'name': f"Track {index}", 'artists': [{'name': f"Artist {index % 50}"}], 'duration_ms': 180_000,
+            'album': {'images': [{'url': "https://i.scdn.co/image/fake"}]}}
+
+
+class Spotify:
+    """Fake spotipy.Spotify. Playlist URLs end in their size, e.g. .../playlist/2000."""
+
+    calls = 0
+
+    def __init__(self, auth_manager=None, **kwargs):
+        pass
+
+    def _call(self):
+        Spotify.calls += 1
+        time.sleep(latency.spotify)
+
+    def _page(self, size, offset, limit):
+        items = [{'track': _spotify_track(index)} for index in range(offset, min(offset + limit, size))]
+        return {'items': items, 'next': "next" if offset + limit < size else None, 'total': size}
+
+    def playlist(self, url, **kwargs):
+        self._call()
+        size = int(url.rstrip("/").rsplit("/", 1)[-1])
+        return {'name': f"Spotify playlist of {size}", 'images': [], 'tracks': self._page(size, 0, 100)}
+
+    def playlist_items(self, url, offset=0, limit=100, **kwargs):
+        self._call()
+        size = int(url.rstrip("/").rsplit("/", 1)[-1])
+        return self._page(size, offset, limit)
+
+    def track(self, url, **kwargs):
+        self._call()
+        return _spotify_track(int(url.rstrip("/").rsplit("/", 1)[-1]))
+
+
+class SpotifyClientCredentials:
+    def __init__(self, client_id=None, client_secret=None, **kwargs):
+        pass
+
+
+# --- wikipedia / requests ------------------------------------------------------
+
+class _WikipediaPage:
+    def __init__(self, title):
+        self.title = title
+        self.summary = f"{title} is an article made up for benchmarking."
+        self.url = f"https://en.wikipedia.org/wiki/{title.replace(' ', '_')}"
+
+
+def wikipedia_random():
+    time.sleep(latency.wikipedia)
+    return f"Random article {next(_ids)}"
+
+
+def wikipedia_page(title):
+    time.sleep(latency.wikipedia)
+    return _WikipediaPage(title)
+
+
+class Session:
+    """Fake requests.Session; the benchmark swaps in wikiGen.FakeWikiSource instead of using it."""
+
+    def __init__(self):
+        self.headers = {}
+
+    def get(self, *args, **kwargs):
+        raise RuntimeError("The benchmark fakes don't make HTTP requests")
+
+
+# --- google-genai --------------------------------------------------------------
+
+class GenaiClient:
+    """Placeholder; the benchmark answers prompts with aiClient.StubBackend."""
+
+    def __init__(self, api_key=None, **kwargs):
+        raise RuntimeError("The benchmark fakes don't talk to Gemini")
+
+
+class _Content:
+    def __init__(self, role=None, parts=None):
+        self.role = role
+        self.parts = parts
+
+
+class _Part:
+    def __init__(self, text=None):
+        self.text = text
+
+
+def _module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    return module
+
+
+def install():
+    """Register the fake modules so that importing bot.py uses them."""
+    utils = _module("discord.utils", get=utils_get)
+    app_commands = _module("discord.app_commands", CommandTree=CommandTree, describe=describe,
+                           default_permissions=default_permissions, Range=Range)
+    commands = _module("discord.ext.commands", Bot=Bot, AutoShardedBot=AutoShardedBot)
+    tasks = _module("discord.ext.tasks", loop=tasks_loop)
+    ext = _module("discord.ext", commands=commands, tasks=tasks)
+    oggparse = _module("discord.oggparse", OggStream=OggStream)
+    discord = _module(
+        "discord", Intents=Intents, Color=Color, Colour=Color, Embed=Embed, ClientException=ClientException,
+        AudioSource=AudioSource, FFmpegPCMAudio=FFmpegPCMAudio, FFmpegOpusAudio=FFmpegOpusAudio,
+        PCMVolumeTransformer=PCMVolumeTransformer, Interaction=Interaction, User=User, Member=User,
+        TextChannel=TextChannel, utils=utils, oggparse=oggparse, app_commands=app_commands, ext=ext,
+    )
+    genai_types = _module("google.genai.types", Content=_Content, Part=_Part)
+    genai = _module("google.genai", Client=GenaiClient, types=genai_types)
+    oauth2 = _module("spotipy.oauth2", SpotifyClientCredentials=SpotifyClientCredentials)
+    wikipedia_exceptions = _module("wikipedia.exceptions", DisambiguationError=type("DisambiguationError", (Exception,), {}),
+                                   PageError=type("PageError", (Exception,), {}))
+    sys.modules.update({
+        "discord": discord,
+        "discord.utils": utils,
+        "discord.oggparse": oggparse,
+        "discord.app_commands": app_commands,
+        "discord.ext": ext,
+        "discord.ext.commands": commands,
+        "discord.ext.tasks": tasks,
+        "yt_dlp": _module("yt_dlp", YoutubeDL=YoutubeDL, utils=_module("yt_dlp.utils", DownloadError=DownloadError)),
+        "spotipy": _module("spotipy", Spotify=Spotify, oauth2=oauth2),
+        "spotipy.oauth2": oauth2,
+        "google": _module("google", genai=genai),
+        "google.genai": genai,
+        "google.genai.types": genai_types,
+        "wikipedia": _module("wikipedia", random=wikipedia_random, page=wikipedia_page, exceptions=wikipedia_exceptions),
+        "wikipedia.exceptions": wikipedia_exceptions,
+        "requests": _module("requests", Session=Session),
+        "dotenv": _module("dotenv", load_dotenv=lambda *args, **kwargs: False),
+    })
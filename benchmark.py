@@ -0,0 +1,336 @@
+"""Offline benchmark for the bot's hot paths.
+
+Imports bot.py against the fakes in benchFakes, builds simulated guilds and users,
+and drives on_message, /play, play_next_song, /ai-response and /random-wiki-article
+with configurable backend latencies. For each scenario it reports throughput, p50 and
+p99 handler latency and how long the event loop stalled, so blocking calls on the
+loop show up as regressions.
+
+    python benchmark.py --guilds 50 --messages 20000
+    python benchmark.py --scenario play --scenario ai --check
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import contextlib
+import benchFakes
+
+SCENARIOS = ("messages", "play", "ai", "wiki")
+
+
+def percentile(values, q):
+    """Return the q-th quantile (0-1) of a list of numbers, by nearest rank."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class StallMonitor:
+    """Measures event loop stalls by checking how late a short periodic tick wakes up."""
+
+    def __init__(self, interval=0.005, threshold=0.02):
+        self.interval = interval
+        self.threshold = threshold  # Lag below this counts as normal scheduling jitter
+        self.max_lag = 0.0
+        self.stall_time = 0.0
+        self.stalls = 0
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def _run(self):
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = time.perf_counter() - expected
+            self.max_lag = max(self.max_lag, lag)
+            if lag > self.threshold:
+                self.stalls += 1
+                self.stall_time += lag
+
+
+def result(name, latencies, elapsed, monitor, **extra):
+    return {
+        "scenario": name,
+        "ops": len(latencies),
+        "ops_per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_lag_ms": monitor.max_lag * 1000,
+        "stall_ms": monitor.stall_time * 1000,
+        **extra,
+    }
+
+
+async def timed_call(latencies, coro):
+    started = time.perf_counter()
+    await coro
+    latencies.append(time.perf_counter() - started)
+
+
+async def bench_messages(bot, guilds, args):
+    """Flood on_message with messages from random members of random guilds."""
+    latencies = []
+    monitor = StallMonitor()
+    monitor.start()
+    started = time.perf_counter()
+    for batch_start in range(0, args.messages, args.batch):
+        batch = []
+        for _ in range(min(args.batch, args.messages - batch_start)):
+            guild = random.choice(guilds)
+            message = benchFakes.FakeMessage(random.choice(guild.members), guild.text_channels[0])
+            batch.append(timed_call(latencies, bot.on_message(message)))
+        await asyncio.gather(*batch)
+    elapsed = time.perf_counter() - started
+    await monitor.stop()
+    # Level-ups are announced in batches shortly afterwards
+    await asyncio.sleep(bot.LEVEL_UP_DELAY + 0.5)
+    announcements = sum(len(guild.text_channels[0].sent) for guild in guilds)
+    awarded = bot.metrics.registry.counter("exp_messages_total", result="awarded")
+    limited = bot.metrics.registry.counter("exp_messages_total", result="limited")
+    return [result("on_message", latencies, elapsed, monitor, announcements=announcements,
+                   limited_rate=limited / (awarded + limited) if awarded + limited else 0.0)]
+
+
+def play_url(index, size):
+    """Cycle through the kinds of links /play accepts."""
+    return (
+        f"https://open.spotify.com/playlist/{size}",
+        f"https://www.youtube.com/playlist?list={size}",
+        f"https://open.spotify.com/track/{index}",
+        f"https://www.youtube.com/watch?v=bench{index}",
+    )[index % 4]
+
+
+async def bench_play(bot, guilds, args):
+    """Run /play in every guild at once, then let the queues play for a while."""
+    tree = bot.client.tree
+    interactions = []
+    now_playing = {}  # guild_id -> time the first Now Playing embed was sent
+    for guild in guilds:
+        member = guild.members[0]
+        guild.join_voice(member)
+        channel = guild.text_channels[0]
+
+        def on_sent(message, guild_id=guild.id):
+            if message.embed is not None and message.embed.title == "Now Playing":
+                now_playing.setdefault(guild_id, time.perf_counter())
+        channel.listeners.append(on_sent)
+        interactions.append(benchFakes.FakeInteraction(member, channel))
+
+    latencies = []
+    monitor = StallMonitor()
+    monitor.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        timed_call(latencies, tree.invoke(interaction, "play", url=play_url(index, args.playlist_size)))
+        for index, interaction in enumerate(interactions)
+    ))
+    handler_elapsed = time.perf_counter() - started
+    time_to_music = [now_playing[i.guild.id] - i.created for i in interactions if i.guild.id in now_playing]
+
+    # Let songs finish so play_next_song runs for every track change
+    await asyncio.sleep(args.play_seconds)
+    elapsed = time.perf_counter() - started
+    await monitor.stop()
+
+    gaps = [gap for vc in bot.client.voice_clients for gap in vc.gaps]
+    hits = sum(bot.metrics.registry.counter("track_prefetch_total", guild=guild.id, result="hit") for guild in guilds)
+    misses = sum(bot.metrics.registry.counter("track_prefetch_total", guild=guild.id, result="miss") for guild in guilds)
+    queued = sum(len(player) for player in bot.players)
+    shared = bot.metrics.registry.counter("shared_audio_opens_total", result="shared")
+    new = bot.metrics.registry.counter("shared_audio_opens_total", result="new")
+
+    for interaction in interactions:
+        await tree.invoke(benchFakes.FakeInteraction(interaction.user, interaction.channel), "stop")
+
+    return [
+        result("/play", latencies, handler_elapsed, monitor,
+               first_song_p50_ms=percentile(time_to_music, 0.5) * 1000,
+               first_song_p99_ms=percentile(time_to_music, 0.99) * 1000,
+               queued_after_run=queued),
+        result("play_next_song", gaps, elapsed, monitor,
+               prefetch_hit_rate=hits / (hits + misses) if hits + misses else 0.0,
+               shared_audio_rate=shared / (shared + new) if shared + new else 0.0),
+    ]
+
+
+async def bench_ai(bot, guilds, args):
+    """Send /ai-response from many channels at once, with some prompts repeated."""
+    tree = bot.client.tree
+    prompts = [f"Question number {index}?" for index in range(args.ai_prompts)]
+    interactions = []
+    for index in range(args.ai_requests):
+        guild = guilds[index % len(guilds)]
+        # A fresh channel per request so repeated prompts can be answered from the cache
+        channel = benchFakes.FakeTextChannel(guild, name=f"ai-{index}")
+        interactions.append(benchFakes.FakeInteraction(guild.members[index % len(guild.members)], channel))
+
+    latencies = []
+    monitor = StallMonitor()
+    monitor.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        timed_call(latencies, tree.invoke(interaction, "ai-response", prompt=random.choice(prompts)))
+        for interaction in interactions
+    ))
+    elapsed = time.perf_counter() - started
+    await monitor.stop()
+
+    first_reply = [i.first_reply - i.created for i in interactions if i.first_reply is not None]
+    return [result("/ai-response", latencies, elapsed, monitor,
+                   first_reply_p50_ms=percentile(first_reply, 0.5) * 1000,
+                   first_reply_p99_ms=percentile(first_reply, 0.99) * 1000,
+                   backend_calls=bot.ai_client.backend.calls)]
+
+
+async def bench_wiki(bot, guilds, args):
+    """Call /random-wiki-article at a steady rate, faster than the pool refills if asked to."""
+    tree = bot.client.tree
+    latencies = []
+    tasks = []
+    interactions = []
+    monitor = StallMonitor()
+    monitor.start()
+    started = time.perf_counter()
+    for index in range(args.wiki_requests):
+        guild = guilds[index % len(guilds)]
+        interaction = benchFakes.FakeInteraction(guild.members[0], guild.text_channels[0])
+        interactions.append(interaction)
+        tasks.append(asyncio.create_task(timed_call(latencies, tree.invoke(interaction, "random-wiki-article"))))
+        await asyncio.sleep(1 / args.wiki_rate)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    await monitor.stop()
+
+    fallbacks = sum(1 for interaction in interactions if interaction.response.deferred)
+    return [result("/random-wiki-article", latencies, elapsed, monitor, pool_misses=fallbacks)]
+
+
+def load_bot(workdir, args):
+    """Import bot.py against the fakes, with its databases in a scratch directory."""
+    os.environ.update({
+        "LEVELS_DB_PATH": os.path.join(workdir, "levels.db"),
+        "RESOLVE_CACHE_PATH": os.path.join(workdir, "resolve_cache.db"),
+        "LEVEL_FLUSH_SECONDS": "1",
+        "AI_EDIT_INTERVAL": str(args.edit_interval),
+        "METRICS_PORT": "0",
+        # The fake voice clients never read audio, so there is nothing for the Opus cache to do
+        "OPUS_CACHE_SIZE_MB": "0",
+        "SHARD_COUNT": str(args.shard_count),
+        "SHARD_IDS": args.shard_ids or "",
+    })
+    benchFakes.install()
+    import bot
+    import aiClient
+    import wikiGen
+    bot.ai_client.backend = aiClient.StubBackend(
+        latency=args.gemini_ms / 1000, chunk_latency=args.gemini_chunk_ms / 1000,
+        reply=lambda history, prompt: f"Here is a long made-up answer to {prompt} " * 8,
+    )
+    bot.wiki_pool.source = wikiGen.FakeWikiSource(latency=args.wikipedia_ms / 1000)
+    return bot
+
+
+async def run(args):
+    benchFakes.latency = benchFakes.Latency(
+        ytdlp=args.ytdlp_ms / 1000, ytdlp_page=args.ytdlp_ms / 1000, spotify=args.spotify_ms / 1000,
+        wikipedia=args.wikipedia_ms / 1000, discord=args.discord_ms / 1000, track_length=args.track_seconds,
+    )
+    scratch = contextlib.nullcontext(args.workdir) if args.workdir else tempfile.TemporaryDirectory()
+    with scratch as workdir:
+        bot = load_bot(workdir, args)
+        shard_ids = {int(shard) for shard in args.shard_ids.split(",")} if args.shard_ids else None
+        guilds = benchFakes.gateway_guilds(bot.client, args.guilds, args.users, args.shard_count, shard_ids)
+        if not guilds:
+            print("No guilds fall on this process's shards; nothing to run.")
+            return []
+        bot.client.guilds.extend(guilds)
+        await bot.on_ready()
+        # Give the article pool its first fill, as it would have after startup
+        await asyncio.sleep(args.wikipedia_ms / 1000 * 2)
+
+        benches = {"messages": bench_messages, "play": bench_play, "ai": bench_ai, "wiki": bench_wiki}
+        results = []
+        try:
+            for name in args.scenario or SCENARIOS:
+                results.extend(await benches[name](bot, guilds, args))
+        finally:
+            bot.loop_monitor.stop()
+            bot.voice_wheel.stop()
+            bot.flush_levels.cancel()
+            bot.resolver.shutdown()
+            bot.search_cache.close()
+            bot.level_store.close()
+        return results
+
+
+def print_table(results):
+    print(f"{'scenario':<22}{'ops':>8}{'ops/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'max lag ms':>12}{'stall ms':>10}")
+    for row in results:
+        print(f"{row['scenario']:<22}{row['ops']:>8}{row['ops_per_second']:>10.1f}{row['p50_ms']:>10.2f}"
+              f"{row['p99_ms']:>10.2f}{row['max_lag_ms']:>12.1f}{row['stall_ms']:>10.1f}")
+        extra = {key: value for key, value in row.items() if key not in (
+            "scenario", "ops", "ops_per_second", "p50_ms", "p99_ms", "max_lag_ms", "stall_ms")}
+        if extra:
+            print("    " + ", ".join(f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}"
+                                   for key, value in extra.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="Run only these scenarios (repeatable)")
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--users", type=int, default=200, help="Members per guild")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=500, help="Messages handled concurrently")
+    parser.add_argument("--playlist-size", type=int, default=1000)
+    parser.add_argument("--play-seconds", type=float, default=3.0, help="How long to let the queues play")
+    parser.add_argument("--track-seconds", type=float, default=0.5, help="Length of every fake song")
+    parser.add_argument("--ai-requests", type=int, default=100)
+    parser.add_argument("--ai-prompts", type=int, default=20, help="Distinct prompts among the AI requests")
+    parser.add_argument("--edit-interval", type=float, default=0.25, help="Seconds between streamed AI edits")
+    parser.add_argument("--wiki-requests", type=int, default=100)
+    parser.add_argument("--wiki-rate", type=float, default=20.0, help="/random-wiki-article calls per second")
+    parser.add_argument("--ytdlp-ms", type=float, default=300)
+    parser.add_argument("--spotify-ms", type=float, default=150)
+    parser.add_argument("--gemini-ms", type=float, default=800)
+    parser.add_argument("--gemini-chunk-ms", type=float, default=50)
+    parser.add_argument("--wikipedia-ms", type=float, default=200)
+    parser.add_argument("--discord-ms", type=float, default=30)
+    parser.add_argument("--shard-count", type=int, default=0, help="Run as one process of a sharded bot")
+    parser.add_argument("--shard-ids", help="Comma-separated shards this process runs; it only sees their guilds")
+    parser.add_argument("--workdir", help="Keep the databases here instead of a temporary directory")
+    parser.add_argument("--json", help="Also write the results to this file as JSON")
+    parser.add_argument("--check", action="store_true", help="Exit non-zero if the loop stalled longer than --max-stall-ms")
+    parser.add_argument("--max-stall-ms", type=float, default=100.0)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.check:
+        stalled = [row["scenario"] for row in results if row["max_lag_ms"] > args.max_stall_ms]
+        if stalled:
+            print(f"❌ Event loop stalled for more than {args.max_stall_ms:.0f}ms in: {', '.join(stalled)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,184 @@
 import os
-import yt_dlp
-import random
+import time
 import asyncio
 import discord
+import contextlib
+import metrics
 import wikiGen as WikipediaGenerator
-from google import genai
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import app_commands
 from spotipy import Spotify
 from spotipy.oauth2 import SpotifyClientCredentials
 from dotenv import load_dotenv
-from collections import defaultdict
+from musicPlayer import PlayerRegistry
+from trackResolver import TrackResolver
+from resolveCache import ResolveCache
+from levelStore import LevelStore
+from rankIndex import RankIndex
+from voiceExp import VoiceTimerWheel, is_earning
+from aiClient import AIClient, GeminiBackend
+from messageChunks import StreamingReply
+from sharedAudio import SharedAudioHub
+from opusCache import OpusCache
+from sharding import ShardFilter
+from expLimiter import ExpLimiter, LevelUpAnnouncer, MIN_REFILL_SECONDS
+from playlistLoader import iterate_in_thread, open_youtube_url, spotify_page_songs, spotify_playlist_pages
 
 load_dotenv()
 
 TOKEN = os.getenv("Discord_Bot_Token")
 SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
+PREFETCH_TRACKS = int(os.getenv("PREFETCH_TRACKS", "3"))
+RESOLVER_WORKERS = int(os.getenv("RESOLVER_WORKERS", "4"))
+RESOLVE_CACHE_PATH = os.getenv("RESOLVE_CACHE_PATH", "resolve_cache.db")
+RESOLVE_CACHE_SIZE = int(os.getenv("RESOLVE_CACHE_SIZE", "50000"))
+LEVELS_DB_PATH = os.getenv("LEVELS_DB_PATH", "levels.db")
+LEVEL_FLUSH_SECONDS = float(os.getenv("LEVEL_FLUSH_SECONDS", "10"))
+LEADERBOARD_PAGE_SIZE = 10
+EXP_BURST = int(os.getenv("EXP_BURST", "3"))  # Messages in a row that earn EXP before the cooldown applies
+EXP_REFILL_SECONDS = float(os.getenv("EXP_REFILL_SECONDS", "20"))  # Cooldown per message after that; 0 disables it
+EXP_LIMITER_SLOTS = int(os.getenv("EXP_LIMITER_SLOTS", str(1 << 22)))  # Cooldown slots, 4 bytes each
+LEVEL_UP_DELAY = float(os.getenv("LEVEL_UP_DELAY", "2"))  # Level-ups within this many seconds share one message
+VOICE_EXP_PER_MINUTE = int(os.getenv("VOICE_EXP_PER_MINUTE", "5"))
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "4"))
+AI_EDIT_INTERVAL = float(os.getenv("AI_EDIT_INTERVAL", "1.0"))
+WIKI_POOL_SIZE = int(os.getenv("WIKI_POOL_SIZE", "20"))
+WIKI_POOL_LOW_WATER = int(os.getenv("WIKI_POOL_LOW_WATER", "5"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))  # Set to 0 to disable the metrics endpoint
+SHARED_AUDIO = os.getenv("SHARED_AUDIO", "1") != "0"  # Set to 0 to give every guild its own FFmpeg process
+OPUS_CACHE_DIR = os.getenv("OPUS_CACHE_DIR", "opus_cache")
+OPUS_CACHE_SIZE_MB = int(os.getenv("OPUS_CACHE_SIZE_MB", "1024"))  # Set to 0 to disable the on-disk Opus cache
+OPUS_CACHE_THRESHOLD = int(os.getenv("OPUS_CACHE_THRESHOLD", "3"))  # Plays before a track is cached
+FFMPEG_BEFORE_OPTIONS = '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'
+# SHARD_COUNT and SHARD_IDS are set by shardLauncher.py; without them the bot runs unsharded
+SHARDS = ShardFilter.from_env()
 
 intents = discord.Intents.default()
 intents.message_content = True
 
-client = commands.Bot(command_prefix="!", intents=intents)
+class InstrumentedTree(app_commands.CommandTree):
+    """Command tree that records how long every slash command takes."""
+
+    async def interaction_check(self, interaction):
+        interaction.extras["started"] = time.perf_counter()
+        return True
+
+    async def on_error(self, interaction, error):
+        observe_command(interaction, "error")
+        await super().on_error(interaction, error)
+
+def observe_command(interaction, status):
+    """Record a finished slash command in the command latency histogram."""
+    started = interaction.extras.get("started")
+    if started is not None and interaction.command is not None:
+        metrics.observe("command_latency_seconds", time.perf_counter() - started,
+                        command=interaction.command.qualified_name, status=status)
+
+if SHARDS.sharded:
+    # Runs the given shards (or all of them) over one connection each, within this process
+    client = commands.AutoShardedBot(
+        command_prefix="!", intents=intents, tree_cls=InstrumentedTree,
+        shard_count=SHARDS.shard_count, shard_ids=sorted(SHARDS.shard_ids) if SHARDS.shard_ids else None
+    )
+else:
+    client = commands.Bot(command_prefix="!", intents=intents, tree_cls=InstrumentedTree)
 spotify = Spotify(auth_manager=SpotifyClientCredentials(
     client_id=SPOTIFY_CLIENT_ID,
     client_secret=SPOTIFY_CLIENT_SECRET
 ))
 
-# Global variables for queue and lock
-song_queue = []
-play_lock = asyncio.Lock()
-
-# Dictionary to store user EXP and levels per server
-user_levels = defaultdict(lambda: defaultdict(lambda: {"exp": 0, "level": 1}))
+# Per-guild music players, each with its own queue, lock and playback state
+players = PlayerRegistry(lambda player: play_next_song(player))
+
+# Remembers which video each search string resolved to, across restarts and guilds
+search_cache = ResolveCache(RESOLVE_CACHE_PATH, max_entries=RESOLVE_CACHE_SIZE)
+
+# Resolves upcoming songs to stream URLs ahead of time so track changes don't wait on yt-dlp
+resolver = TrackResolver(lookahead=PREFETCH_TRACKS, workers=RESOLVER_WORKERS, search_cache=search_cache)
+
+# User EXP and levels per server, kept in memory and written behind to SQLite; only this process's shards
+level_store = LevelStore(LEVELS_DB_PATH, owns=SHARDS.owns)
+
+# One shared Gemini client with per-channel conversations and a response cache
+ai_client = AIClient(GeminiBackend(os.getenv("GEMENI_KEY"), GEMINI_MODEL), max_concurrency=AI_MAX_CONCURRENCY)
+
+# Random Wikipedia articles fetched ahead of time so /random-wiki-article can answer instantly
+wiki_pool = WikipediaGenerator.ArticlePool(
+    WikipediaGenerator.MediaWikiSource(), size=WIKI_POOL_SIZE, low_water=WIKI_POOL_LOW_WATER
+)
+
+# Guilds playing the same track share one FFmpeg decode of it
+audio_hub = SharedAudioHub()
+
+# Popular tracks kept on disk as Opus files, so replays skip both the download and the transcode
+opus_cache = OpusCache(
+    OPUS_CACHE_DIR, OPUS_CACHE_SIZE_MB * 1024 * 1024, threshold=OPUS_CACHE_THRESHOLD, before_options=FFMPEG_BEFORE_OPTIONS
+) if OPUS_CACHE_SIZE_MB > 0 else None
+
+# Which messages earn EXP, with per-server cooldowns, and batched level-up announcements
+exp_limiter = ExpLimiter(burst=EXP_BURST, refill_seconds=EXP_REFILL_SECONDS, slots=EXP_LIMITER_SLOTS)
+for cooldown_guild_id, (burst, refill_seconds) in level_store.exp_cooldowns().items():
+    exp_limiter.configure(cooldown_guild_id, burst, refill_seconds)
+level_ups = LevelUpAnnouncer(delay=LEVEL_UP_DELAY)
+
+# Per-server EXP ordering for /leaderboard and /rank, updated whenever EXP changes
+rank_index = RankIndex(level_store)
+
+# Members earning voice EXP, all driven by a single timer wheel
+voice_wheel = VoiceTimerWheel(lambda guild_id, user_ids: award_voice_exp(guild_id, user_ids))
+
+# Guilds without a configured announcement channel fall back to #general, looked up once
+general_channels = {}
+
+# Event loop lag and blocked-loop detection, plus the local Prometheus endpoint once started
+loop_monitor = metrics.LoopMonitor()
+metrics_server = None
+
+def collect_bot_metrics():
+    """Report queue depths and cache statistics as gauge samples."""
+    samples = [("music_queue_depth", {"guild": player.guild_id}, len(player)) for player in players]
+    samples += [
+        ("music_players", {}, len(players)),
+        ("resolver_pending", {}, resolver.pending()),
+        ("resolve_cache_hits", {}, search_cache.hits),
+        ("resolve_cache_misses", {}, search_cache.misses),
+        ("ai_cache_hits", {}, ai_client.cache.hits),
+        ("ai_cache_misses", {}, ai_client.cache.misses),
+        ("wiki_pool_size", {}, len(wiki_pool)),
+        ("voice_exp_members", {}, len(voice_wheel)),
+        ("shared_audio_streams", {}, len(audio_hub)),
+        ("shared_audio_listeners", {}, audio_hub.listeners()),
+    ]
+    if SHARDS.sharded:
+        samples += [("gateway_latency_seconds", {"shard": shard_id}, latency) for shard_id, latency in client.latencies]
+    if opus_cache:
+        samples += [
+            ("opus_cache_files", {}, len(opus_cache)),
+            ("opus_cache_bytes", {}, opus_cache.size()),
+            ("opus_cache_hits", {}, opus_cache.hits),
+            ("opus_cache_misses", {}, opus_cache.misses),
+        ]
+    return samples
+
+metrics.add_collector(collect_bot_metrics)
 
 def calculate_level(exp):
     """Calculate the level based on EXP."""
     return int((exp // 100) ** 0.5) + 1
 
+def award_exp(guild_id, user_id, amount):
+    """Add EXP to a user and return their new level if they leveled up, otherwise None."""
+    user_data = level_store.add_exp(guild_id, user_id, amount)
+    rank_index.update(guild_id, user_id, user_data["exp"])
+    new_level = calculate_level(user_data["exp"])
+    if new_level > user_data["level"]:
+        user_data["level"] = new_level
+        return new_level
+    return None
+
 @client.event
 async def on_message(message):
     """Handle text message events to award EXP."""
@@ -47,49 +188,123 @@ async def on_message(message):
     guild_id = message.guild.id
     user_id = message.author.id
 
-    # Award EXP for sending a message
-    user_data = user_levels[guild_id][user_id]
-    user_data["exp"] += 10
-    new_level = calculate_level(user_data["exp"])
-
-    # Check if the user leveled up
-    if new_level > user_data["level"]:
-        user_data["level"] = new_level
-        await message.channel.send(f"🎉 {message.author.mention} leveled up to **Level {new_level}**!")
+    # Award EXP for sending a message unless the user is on cooldown, and check if they leveled up
+    if exp_limiter.allow(guild_id, user_id):
+        new_level = award_exp(guild_id, user_id, 10)
+        if new_level:
+            level_ups.announce(message.channel, user_id, new_level)
 
     await client.process_commands(message)  # Ensure commands still work
 
+def announcement_channel(guild):
+    """Return the channel level-ups in a server are announced in, or None."""
+    channel_id = level_store.announcement_channel(guild.id)
+    if channel_id is None:
+        if guild.id not in general_channels:
+            general = discord.utils.get(guild.text_channels, name="general")
+            general_channels[guild.id] = general.id if general else None
+        channel_id = general_channels[guild.id]
+    return guild.get_channel(channel_id) if channel_id else None
+
+async def award_voice_exp(guild_id, user_ids):
+    """Award a minute of voice EXP to members of a server and announce any level-ups."""
+    leveled_up = []
+    for user_id in user_ids:
+        new_level = award_exp(guild_id, user_id, VOICE_EXP_PER_MINUTE)
+        if new_level:
+            leveled_up.append((user_id, new_level))
+
+    guild = client.get_guild(guild_id)
+    text_channel = announcement_channel(guild) if guild and leveled_up else None
+    if text_channel:
+        for user_id, new_level in leveled_up:
+            level_ups.announce(text_channel, user_id, new_level)
+
+def track_voice_state(member, voice_state):
+    """Start or stop a member's voice EXP depending on their current voice state."""
+    if is_earning(voice_state, member.guild.afk_channel):
+        voice_wheel.track(member.guild.id, member.id)
+    else:
+        voice_wheel.untrack(member.guild.id, member.id)
+
 @client.event
 async def on_voice_state_update(member, before, after):
-    """Handle voice state updates to award EXP."""
+    """Handle voice state updates to accrue EXP for time spent in voice."""
     if member.bot:
         return  # Ignore bot actions
 
-    guild_id = member.guild.id
-    user_id = member.id
+    # Members earn EXP every minute while in voice, unless muted, deafened or AFK
+    track_voice_state(member, after)
 
-    # Award EXP when a user joins a voice channel
-    if before.channel is None and after.channel is not None:
-        user_data = user_levels[guild_id][user_id]
-        user_data["exp"] += 20
-        new_level = calculate_level(user_data["exp"])
+@client.event
+async def on_guild_channel_create(channel):
+    """Forget the cached #general lookup when a server's channels change."""
+    general_channels.pop(channel.guild.id, None)
 
-        # Check if the user leveled up
-        if new_level > user_data["level"]:
-            user_data["level"] = new_level
-            text_channel = discord.utils.get(member.guild.text_channels, name="general")
-            if text_channel:
-                await text_channel.send(f"🎉 {member.mention} leveled up to **Level {new_level}**!")
+@client.event
+async def on_guild_channel_update(before, after):
+    """Forget the cached #general lookup when a server's channels change."""
+    general_channels.pop(after.guild.id, None)
 
 @client.event
-async def on_ready():
-    """Sync slash commands and confirm bot is ready."""
+async def on_guild_channel_delete(channel):
+    """Forget the cached #general lookup when a server's channels change."""
+    general_channels.pop(channel.guild.id, None)
+
+@client.event
+async def on_guild_remove(guild):
+    """Drop per-server voice and announcement state when the bot leaves a server."""
+    voice_wheel.untrack_guild(guild.id)
+    general_channels.pop(guild.id, None)
+
+@tasks.loop(seconds=LEVEL_FLUSH_SECONDS)
+async def flush_levels():
+    """Periodically write batched EXP changes to disk."""
+    rows = level_store.collect()
     try:
-        await client.tree.sync()
-        print(f"✅ Synced slash commands for {client.user}.")
+        await asyncio.to_thread(level_store.write, rows)
     except Exception as e:
-        print(f"❌ Failed to sync commands: {e}")
-    print(f"Bot is ready and logged in as {client.user}!")
+        print(f"Error saving levels: {e}")
+
+@client.event
+async def on_app_command_completion(interaction, command):
+    """Record how long a successful slash command took."""
+    observe_command(interaction, "ok")
+
+@client.event
+async def on_ready():
+    """Sync slash commands and confirm bot is ready."""
+    if not flush_levels.is_running():
+        flush_levels.start()
+    wiki_pool.refill()
+    loop_monitor.start()
+
+    global metrics_server
+    if METRICS_PORT and metrics_server is None:
+        try:
+            metrics_server = await metrics.serve(METRICS_HOST, METRICS_PORT)
+            print(f"📈 Serving metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+        except OSError as e:
+            print(f"❌ Failed to start metrics endpoint: {e}")
+
+    # Rebuild voice EXP from who is in voice now; updates missed while disconnected never arrive
+    voice_wheel.clear()
+    for guild in client.guilds:
+        for channel in guild.voice_channels + guild.stage_channels:
+            for user_id, voice_state in channel.voice_states.items():
+                member = guild.get_member(user_id)
+                if member and not member.bot:
+                    track_voice_state(member, voice_state)
+    voice_wheel.start()
+    # Commands are global, so with several shard processes only the one running shard 0 syncs them
+    if SHARDS.owns_shard(0):
+        try:
+            await client.tree.sync()
+            print(f"✅ Synced slash commands for {client.user}.")
+        except Exception as e:
+            print(f"❌ Failed to sync commands: {e}")
+    shards = f" on shards {', '.join(map(str, sorted(SHARDS.shard_ids)))}" if SHARDS.sharded and SHARDS.shard_ids else ""
+    print(f"Bot is ready and logged in as {client.user}{shards}!")
 
 @client.tree.command(name="level", description="Check your current level and EXP")
 @app_commands.describe(user="The user whose level you want to check (leave blank for yourself)")
@@ -99,7 +314,7 @@ async def level(interaction: discord.Interaction, user: discord.User = None):
     guild_id = interaction.guild.id
     user_id = user.id
 
-    user_data = user_levels[guild_id][user_id]
+    user_data = level_store.get(guild_id, user_id)
     exp = user_data["exp"]
     level = user_data["level"]
 
@@ -111,69 +326,183 @@ async def level(interaction: discord.Interaction, user: discord.User = None):
     embed.add_field(name="EXP", value=exp, inline=True)
     await interaction.response.send_message(embed=embed)
 
-async def play_next_song(vc, text_channel):
-    """Plays the next song in the queue."""
-    global song_queue
+@client.tree.command(name="set-level-channel", description="Choose the channel level-ups are announced in")
+@app_commands.describe(channel="The channel to announce level-ups in")
+@app_commands.default_permissions(manage_guild=True)
+async def setLevelChannel(interaction: discord.Interaction, channel: discord.TextChannel):
+    """Configures the server's level-up announcement channel."""
+    await asyncio.to_thread(level_store.set_announcement_channel, interaction.guild.id, channel.id)
+    await interaction.response.send_message(f"📣 Level-ups will now be announced in {channel.mention}.")
+
+@client.tree.command(name="set-exp-cooldown", description="Choose how often messages earn EXP")
+@app_commands.describe(
+    burst="How many messages in a row earn EXP",
+    seconds="Seconds until another message earns EXP after that (0 for no cooldown)"
+)
+@app_commands.default_permissions(manage_guild=True)
+async def setExpCooldown(interaction: discord.Interaction, burst: app_commands.Range[int, 1, 100],
+                         seconds: app_commands.Range[float, 0, 3600]):
+    """Configures the server's EXP cooldown."""
+    if 0 < seconds < MIN_REFILL_SECONDS:
+        await interaction.response.send_message(
+            f"⚠️ The cooldown must be 0 (off) or at least {MIN_REFILL_SECONDS:g} seconds.", ephemeral=True
+        )
+        return
+    await asyncio.to_thread(level_store.set_exp_cooldown, interaction.guild.id, burst, seconds)
+    exp_limiter.configure(interaction.guild.id, burst, seconds)
+    # Report the settings as the limiter applies them, after rounding
+    burst, seconds = exp_limiter.settings(interaction.guild.id)
+    if seconds:
+        await interaction.response.send_message(
+            f"⏱️ Up to {burst} messages in a row earn EXP, then one every {seconds:g} seconds."
+        )
+    else:
+        await interaction.response.send_message("⏱️ Every message now earns EXP.")
 
-    async with play_lock:
-        if len(song_queue) == 0:
-            await text_channel.send("🎵 The queue is empty. Add more songs to keep the music going!")
-            return
+@client.tree.command(name="leaderboard", description="Show the server's EXP leaderboard")
+@app_commands.describe(page="The page of the leaderboard to show")
+async def leaderboard(interaction: discord.Interaction, page: app_commands.Range[int, 1] = 1):
+    """Displays one page of the server's users ordered by EXP."""
+    ranking = rank_index.guild(interaction.guild.id)
+    pages = max(1, (len(ranking) + LEADERBOARD_PAGE_SIZE - 1) // LEADERBOARD_PAGE_SIZE)
+    page = min(page, pages)
+    start = (page - 1) * LEADERBOARD_PAGE_SIZE
 
-        # Get the next song in the queue
-        next_song = song_queue.pop(0)
+    lines = []
+    for position, (user_id, exp) in enumerate(ranking.page(start, LEADERBOARD_PAGE_SIZE), start=start + 1):
+        lines.append(f"**{position}.** <@{user_id}> - Level {calculate_level(exp)} ({exp} EXP)")
 
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'quiet': True,
-            'default_search': 'ytsearch',
-            'noplaylist': True,
-        }
+    embed = discord.Embed(
+        title=f"Leaderboard - {interaction.guild.name}",
+        description="\n".join(lines) or "Nobody has earned any EXP yet.",
+        color=discord.Color.gold()
+    )
+    embed.set_footer(text=f"Page {page} of {pages}")
+    await interaction.response.send_message(embed=embed)
+
+@client.tree.command(name="rank", description="Check your position on the server's leaderboard")
+@app_commands.describe(user="The user whose rank you want to check (leave blank for yourself)")
+async def rank(interaction: discord.Interaction, user: discord.User = None):
+    """Displays a user's leaderboard position."""
+    user = user or interaction.user  # Default to the command invoker if no user is specified
+    ranking = rank_index.guild(interaction.guild.id)
+    position = ranking.rank(user.id)
+    user_data = level_store.get(interaction.guild.id, user.id)
+
+    embed = discord.Embed(
+        title=f"Rank - {user}",
+        color=discord.Color.gold()
+    )
+    embed.add_field(name="Rank", value=f"#{position} of {len(ranking)}" if position else "Unranked", inline=True)
+    embed.add_field(name="Level", value=user_data["level"], inline=True)
+    embed.add_field(name="EXP", value=user_data["exp"], inline=True)
+    await interaction.response.send_message(embed=embed)
+
+async def play_next_song(player):
+    """Plays the next song in the guild's queue."""
+    async with player.lock:
+        vc = player.voice_client
+        text_channel = player.text_channel
+
+        # Another caller already started a song while we waited for the lock
+        if player.stopped or vc is None or player.is_active():
+            return
 
         ffmpeg_opts = {
-            'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
+            'before_options': FFMPEG_BEFORE_OPTIONS,
             'options': '-vn',
         }
 
+        while True:
+            # Every song would fail the same way without a voice connection; keep the queue for later
+            if not vc.is_connected():
+                return
+
+            # Get the next song in the queue
+            next_song = player.next_song()
+            if next_song is None:
+                # A background loader will restart playback when its next page arrives
+                if player.is_loading():
+                    return
+                await text_channel.send("🎵 The queue is empty. Add more songs to keep the music going!")
+                return
+
+            try:
+                # Fetch song information, usually already prefetched while the last song played
+                prefetched = resolver.cached(next_song) is not None
+                metrics.inc("track_prefetch_total", guild=player.guild_id, result="hit" if prefetched else "miss")
+                info = await resolver.resolve(next_song)
+
+                audio_url = info['url']
+                song_title = info['title']
+                song_link = info['webpage_url']
+                song_thumbnail = info['thumbnail']
+
+                # The player may have been stopped while the song was being resolved
+                if player.stopped:
+                    return
+
+                # Play the audio from the local Opus cache as-is, or by reusing the Opus frames
+                # of any guild already playing this track
+                cached_path = opus_cache.lookup(info['id']) if opus_cache and info.get('id') else None
+                if cached_path:
+                    audio_source = discord.FFmpegOpusAudio(cached_path, codec='copy')
+                elif SHARED_AUDIO and info.get('id'):
+                    audio_source = audio_hub.open(info['id'], audio_url, before_options=ffmpeg_opts['before_options'])
+                else:
+                    audio_source = discord.PCMVolumeTransformer(discord.FFmpegPCMAudio(audio_url, **ffmpeg_opts))
+                try:
+                    vc.play(audio_source, after=player.after_playing)
+                except Exception:
+                    # Nothing will play the source, so release its shared stream or FFmpeg process
+                    audio_source.cleanup()
+                    raise
+                break
+
+            except discord.ClientException as e:
+                # Disconnected, or already playing; skipping ahead would only throw the queue away
+                print(f"Error starting playback: {e}")
+                player.queue.appendleft(next_song)
+                return
+            except Exception as e:
+                print(f"Error in play_next_song: {e}")
+                await text_channel.send("⚠️ An error occurred while playing the song. Skipping to the next song...")
+
+        if opus_cache and info.get('id'):
+            opus_cache.record_play(info['id'], audio_url)
+
+        # Start resolving the next few songs while this one plays
+        resolver.prefetch(player.upcoming(resolver.lookahead))
+
+        # Send embed for the currently playing song
+        embed = discord.Embed(
+            title="Now Playing",
+            description=f"**[{song_title}]({song_link})**",
+            color=discord.Color.green()
+        )
+        if song_thumbnail:
+            embed.set_thumbnail(url=song_thumbnail)
+        embed.set_footer(text="Enjoy your music!")
         try:
-            # Fetch song information
-            def fetch_audio_info():
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    return ydl.extract_info(next_song, download=False)
-
-            info = await asyncio.to_thread(fetch_audio_info)
-            if 'entries' in info:
-                info = info['entries'][0]
-
-            audio_url = info['url']
-            song_title = info.get('title', 'Unknown Title')
-            song_link = info.get('webpage_url', 'Unknown Link')
-            song_thumbnail = info.get('thumbnail', None)
-
-            # Play the audio
-            def after_playing(error):
-                if error:
-                    print(f"Error during playback: {error}")
-                asyncio.run_coroutine_threadsafe(play_next_song(vc, text_channel), client.loop)
-
-            audio_source = discord.PCMVolumeTransformer(discord.FFmpegPCMAudio(audio_url, **ffmpeg_opts))
-            vc.play(audio_source, after=after_playing)
-
-            # Send embed for the currently playing song
-            embed = discord.Embed(
-                title="Now Playing",
-                description=f"**[{song_title}]({song_link})**",
-                color=discord.Color.green()
-            )
-            if song_thumbnail:
-                embed.set_thumbnail(url=song_thumbnail)
-            embed.set_footer(text="Enjoy your music!")
             await text_channel.send(embed=embed)
-
         except Exception as e:
-            print(f"Error in play_next_song: {e}")
-            await text_channel.send("⚠️ An error occurred while playing the song. Skipping to the next song...")
-            await play_next_song(vc, text_channel)
+            print(f"Error announcing the song now playing: {e}")
+
+
+async def enqueue_pages(player, pages):
+    """Adds pages of songs to the player's queue as a background producer yields them."""
+    try:
+        async for songs in pages:
+            if player.stopped:
+                return
+            player.extend(songs)
+            # Resume playback if the queue ran dry while waiting for this page
+            if not player.is_active():
+                await play_next_song(player)
+            else:
+                resolver.prefetch(player.upcoming(resolver.lookahead))
+    except Exception as e:
+        print(f"Error loading playlist pages: {e}")
 
 
 @client.tree.command(name="hello", description="Say Hello")
@@ -186,38 +515,52 @@ async def aiResponse(interaction: discord.Interaction, prompt: str):
     # Defer the interaction to acknowledge it and give more time to process
     await interaction.response.defer()
 
-    gemeni = genai.Client(api_key=os.getenv("GEMENI_KEY"))
-    chat = gemeni.chats.create(model="gemini-2.0-flash")
-    response = chat.send_message(prompt)
-
-    response_text = response.text
-
-    # Ensure the response is within Discord's character limit
-    if len(response_text) > 2000:
-        response_text = response_text[:2000]
-
     if not prompt.strip():
         await interaction.followup.send("Please provide a valid question or prompt.")
         return
 
-    # Send the response as a follow-up message
-    await interaction.followup.send(response_text)
+    # Stream the response into follow-up messages, split across several if it's too long
+    reply = StreamingReply(lambda content: interaction.followup.send(content, wait=True), interval=AI_EDIT_INTERVAL)
+    try:
+        # Close the stream straight away on errors, releasing its session lock and concurrency slot
+        async with contextlib.aclosing(ai_client.stream(interaction.channel_id, prompt)) as pieces:
+            async for piece in pieces:
+                await reply.feed(piece)
+        await reply.finish()
+    except Exception as e:
+        print(f"Error in aiResponse: {e}")
+        if reply.messages:
+            # Show what arrived without the cursor, so it doesn't look like it is still being written
+            try:
+                await reply.finish()
+            except Exception as e:
+                print(f"Error showing a partial AI response: {e}")
+        await interaction.followup.send("⚠️ Failed to get a response from the AI. Please try again later.")
 
 @client.tree.command(name="random-wiki-article", description="Grabs a random Wikipedia article and puts it in the channel")
 async def randomWiki(interaction: discord.Interaction):
     try:
-        article = WikipediaGenerator.randomWikiGen()
-        await interaction.response.send_message(article)
+        article = wiki_pool.take()
+        if article is not None:
+            await interaction.response.send_message(WikipediaGenerator.formatArticle(article))
+            return
+
+        # The pool is still filling, so fetch an article directly without blocking the event loop
+        await interaction.response.defer()
+        article = await asyncio.to_thread(WikipediaGenerator.randomWikiGen)
+        await interaction.followup.send(article)
     except Exception as e:
-        await interaction.response.send_message("An error occurred while fetching a Wikipedia article. Please try again later.")
+        error_message = "An error occurred while fetching a Wikipedia article. Please try again later."
+        if interaction.response.is_done():
+            await interaction.followup.send(error_message)
+        else:
+            await interaction.response.send_message(error_message)
         print(f"Error in randomWiki: {e}")
 
 @client.tree.command(name="play", description="Play a YouTube or Spotify track or playlist in a voice channel")
 @app_commands.describe(url="The YouTube or Spotify track or playlist URL")
 async def play(interaction: discord.Interaction, url: str):
     """Adds a song or playlist to the queue and starts playback."""
-    global song_queue
-
     if not interaction.user.voice or not interaction.user.voice.channel:
         await interaction.response.send_message("You must be in a voice channel to use this command.", ephemeral=True)
         return
@@ -232,31 +575,30 @@ async def play(interaction: discord.Interaction, url: str):
     except discord.ClientException:
         vc = discord.utils.get(client.voice_clients, guild=interaction.guild)
 
+    player = players.get(interaction.guild.id)
+    if vc:
+        player.bind(vc, text_channel)
+
     if "spotify.com" in url:
         try:
             if "playlist" in url:
-                # Fetch playlist metadata
-                playlist_metadata = spotify.playlist(url)
+                # Fetch playlist metadata along with the first page of tracks
+                with metrics.timed("external_call_seconds", service="spotify"):
+                    playlist_metadata = await asyncio.to_thread(spotify.playlist, url)
                 playlist_title = playlist_metadata['name']
                 playlist_cover = playlist_metadata['images'][0]['url'] if playlist_metadata['images'] else None
 
-                # Fetch all tracks in the playlist using pagination
-                track_list = []
-                offset = 0
-                while True:
-                    playlist_items = spotify.playlist_items(url, offset=offset, limit=100)
-                    for item in playlist_items['items']:
-                        try:
-                            track_name = item['track']['name']
-                            artist_name = item['track']['artists'][0]['name']
-                            song_queue.append(f"{track_name} {artist_name}")
-                            track_list.append(f"{track_name} by {artist_name}")
-                        except (KeyError, TypeError):
-                            # Skip tracks with missing or invalid metadata
-                            print(f"Skipping an unavailable track in the playlist: {item}")
-                    if not playlist_items['next']:
-                        break
-                    offset += 100
+                # Queue the first page now so playback can start straight away
+                first_page = playlist_metadata['tracks']
+                songs, track_list = spotify_page_songs(first_page['items'])
+                first_position = len(player) + 1
+                player.extend(songs)
+                total_tracks = first_page.get('total', len(songs))
+
+                # Fetch the remaining pages in the background
+                if first_page['next']:
+                    pages = spotify_playlist_pages(spotify, url, offset=len(first_page['items']))
+                    player.start_loader(enqueue_pages(player, iterate_in_thread(pages)))
 
                 # Create an embed for the playlist
                 embed = discord.Embed(
@@ -264,8 +606,8 @@ async def play(interaction: discord.Interaction, url: str):
                     description=f"**[{playlist_title}]({url})**",
                     color=discord.Color.green()
                 )
-                embed.add_field(name="Number of Tracks", value=str(len(track_list)), inline=True)
-                embed.add_field(name="Position in Queue", value=f"{len(song_queue) - len(track_list) + 1} - {len(song_queue)}", inline=True)
+                embed.add_field(name="Number of Tracks", value=str(total_tracks), inline=True)
+                embed.add_field(name="Position in Queue", value=f"{first_position} - {first_position + total_tracks - 1}", inline=True)
                 embed.add_field(name="Tracks", value="\n".join(track_list[:5]) + ("..." if len(track_list) > 5 else ""), inline=False)
                 if playlist_cover:
                     embed.set_thumbnail(url=playlist_cover)
@@ -273,12 +615,13 @@ async def play(interaction: discord.Interaction, url: str):
                 await interaction.followup.send(embed=embed)
             else:
                 # Handle single Spotify track
-                track = spotify.track(url)
+                with metrics.timed("external_call_seconds", service="spotify"):
+                    track = await asyncio.to_thread(spotify.track, url)
                 track_name = track['name']
                 artist_name = track['artists'][0]['name']
                 track_length = track['duration_ms'] // 1000  # Convert milliseconds to seconds
                 album_art = track['album']['images'][0]['url'] if track['album']['images'] else None
-                song_queue.append(f"{track_name} {artist_name}")
+                player.enqueue(f"{track_name} {artist_name}")
 
                 # Create an embed for the track
                 embed = discord.Embed(
@@ -287,7 +630,7 @@ async def play(interaction: discord.Interaction, url: str):
                     color=discord.Color.green()
                 )
                 embed.add_field(name="Track Length", value=f"{track_length // 60}:{track_length % 60:02}", inline=True)
-                embed.add_field(name="Position in Queue", value=str(len(song_queue)), inline=True)
+                embed.add_field(name="Position in Queue", value=str(len(player)), inline=True)
                 embed.set_image(url=album_art)
                 embed.set_footer(text=f"Requested by {interaction.user.display_name}", icon_url=interaction.user.avatar.url)
                 await interaction.followup.send(embed=embed)
@@ -297,44 +640,52 @@ async def play(interaction: discord.Interaction, url: str):
             return
     elif "youtube.com" in url or "youtu.be" in url:
         try:
-            with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
-                info = ydl.extract_info(url, download=False)
-                if 'entries' in info:
-                    # Handle YouTube playlist
-                    track_list = []
-                    for entry in info['entries']:
-                        song_queue.append(entry['webpage_url'])
-                        track_list.append(entry['title'])
-
-                    # Create an embed for the playlist
-                    playlist_title = info['title']
-                    playlist_cover = info.get('thumbnail', None)
-                    embed = discord.Embed(
-                        title="Added Playlist",
-                        description=f"**[{playlist_title}]({url})**",
-                        color=discord.Color.red()
-                    )
-                    embed.add_field(name="Number of Tracks", value=str(len(info['entries'])), inline=True)
-                    embed.add_field(name="Position in Queue", value=f"{len(song_queue) - len(info['entries']) + 1} - {len(song_queue)}", inline=True)
-                    embed.add_field(name="Tracks", value="\n".join(track_list[:5]) + ("..." if len(track_list) > 5 else ""), inline=False)
-                    if playlist_cover:
-                        embed.set_thumbnail(url=playlist_cover)
-                    embed.set_footer(text=f"Requested by {interaction.user.display_name}", icon_url=interaction.user.avatar.url)
-                    await interaction.followup.send(embed=embed)
+            # List playlists flat in a worker thread; entries are resolved shortly before they play
+            info, batches = await asyncio.to_thread(open_youtube_url, url)
+            if batches is not None:
+                # Handle YouTube playlist: queue the first batch now and stream in the rest
+                entries = iterate_in_thread(batches)
+                first_batch = await anext(entries, [])
+                track_list = [title for _, title in first_batch]
+                first_position = len(player) + 1
+                player.extend(link for link, _ in first_batch)
+                total_tracks = info.get('playlist_count')
+                player.start_loader(enqueue_pages(player, ([link for link, _ in batch] async for batch in entries)))
+
+                # Create an embed for the playlist
+                playlist_title = info.get('title', 'YouTube Playlist')
+                thumbnails = info.get('thumbnails') or [{}]
+                playlist_cover = info.get('thumbnail') or thumbnails[-1].get('url')
+                embed = discord.Embed(
+                    title="Added Playlist",
+                    description=f"**[{playlist_title}]({url})**",
+                    color=discord.Color.red()
+                )
+                if total_tracks:
+                    embed.add_field(name="Number of Tracks", value=str(total_tracks), inline=True)
+                    embed.add_field(name="Position in Queue", value=f"{first_position} - {first_position + total_tracks - 1}", inline=True)
                 else:
-                    # Handle single YouTube video
-                    track_length = info['duration']  # Duration in seconds
-                    song_queue.append(info['webpage_url'])
-                    embed = discord.Embed(
-                        title="Added Track",
-                        description=f"**[{info['title']}]({url})**",
-                        color=discord.Color.red()
-                    )
-                    embed.add_field(name="Track Length", value=f"{track_length // 60}:{track_length % 60:02}", inline=True)
-                    embed.add_field(name="Position in Queue", value=str(len(song_queue)), inline=True)
-                    embed.set_image(url=info.get('thumbnail', None))
-                    embed.set_footer(text=f"Requested by {interaction.user.display_name}", icon_url=interaction.user.avatar.url)
-                    await interaction.followup.send(embed=embed)
+                    embed.add_field(name="Number of Tracks", value=f"{len(first_batch)}+", inline=True)
+                    embed.add_field(name="Position in Queue", value=f"{first_position}+", inline=True)
+                embed.add_field(name="Tracks", value="\n".join(track_list[:5]) + ("..." if len(track_list) > 5 else ""), inline=False)
+                if playlist_cover:
+                    embed.set_thumbnail(url=playlist_cover)
+                embed.set_footer(text=f"Requested by {interaction.user.display_name}", icon_url=interaction.user.avatar.url)
+                await interaction.followup.send(embed=embed)
+            else:
+                # Handle single YouTube video
+                track_length = info['duration']  # Duration in seconds
+                player.enqueue(info['webpage_url'])
+                embed = discord.Embed(
+                    title="Added Track",
+                    description=f"**[{info['title']}]({url})**",
+                    color=discord.Color.red()
+                )
+                embed.add_field(name="Track Length", value=f"{track_length // 60}:{track_length % 60:02}", inline=True)
+                embed.add_field(name="Position in Queue", value=str(len(player)), inline=True)
+                embed.set_image(url=info.get('thumbnail', None))
+                embed.set_footer(text=f"Requested by {interaction.user.display_name}", icon_url=interaction.user.avatar.url)
+                await interaction.followup.send(embed=embed)
         except Exception as e:
             await interaction.followup.send("⚠️ Failed to fetch video or playlist information from YouTube.")
             print(f"Error fetching YouTube data: {e}")
@@ -343,17 +694,20 @@ async def play(interaction: discord.Interaction, url: str):
         await interaction.followup.send("⚠️ Invalid URL. Please provide a valid YouTube or Spotify link.")
         return
 
-    if vc and not vc.is_playing():
-        await play_next_song(vc, text_channel)
+    if vc and not player.is_active():
+        await play_next_song(player)
+    else:
+        resolver.prefetch(player.upcoming(resolver.lookahead))
 
 
 @client.tree.command(name="skip", description="Skip the current song and play the next one in the queue")
 async def skip(interaction: discord.Interaction):
     """Skips the current song and plays the next one."""
-    vc = discord.utils.get(client.voice_clients, guild=interaction.guild)
+    player = players.find(interaction.guild.id)
 
-    if vc and vc.is_playing():
-        vc.stop()
+    if player and player.is_active():
+        # Stopping the current song fires the player's after callback, which starts the next one
+        player.skip()
         await interaction.response.send_message("⏭️ Skipped the current song.")
     else:
         await interaction.response.send_message("⚠️ No song is currently playing.", ephemeral=True)
@@ -365,6 +719,8 @@ async def stop(interaction: discord.Interaction):
     vc = discord.utils.get(client.voice_clients, guild=interaction.guild)
 
     if vc and vc.is_connected():
+        # Drop the guild's player first so stopping doesn't advance to the next song
+        players.remove(interaction.guild.id)
         if vc.is_playing():
             vc.stop()
         await vc.disconnect()
@@ -376,13 +732,13 @@ async def stop(interaction: discord.Interaction):
 @client.tree.command(name="shuffle", description="Shuffle the current song queue")
 async def shuffle(interaction: discord.Interaction):
     """Shuffles the current song queue."""
-    global song_queue
+    player = players.find(interaction.guild.id)
 
-    if len(song_queue) == 0:
+    if player is None or len(player) == 0:
         await interaction.response.send_message("⚠️ The queue is empty. Add some songs first!", ephemeral=True)
         return
 
-    random.shuffle(song_queue)
+    player.shuffle()
     await interaction.response.send_message("🔀 The queue has been shuffled!")
 
 @client.tree.command(name="ping", description="Check the bot's latency")
@@ -391,6 +747,66 @@ async def ping(interaction: discord.Interaction):
     latency = round(client.latency * 1000)  # Convert to milliseconds
     await interaction.response.send_message(f"🏓 Pong! Latency: {latency}ms")
 
+def format_latency(histogram):
+    """Summarize a latency histogram as call count, p50 and p99."""
+    return f"{histogram.count} calls, p50 {histogram.quantile(0.5) * 1000:.0f}ms, p99 {histogram.quantile(0.99) * 1000:.0f}ms"
+
+def hit_rate(hits, misses):
+    """Format a cache hit rate."""
+    lookups = hits + misses
+    return f"{hits / lookups:.0%} of {lookups}" if lookups else "no lookups"
+
+@client.tree.command(name="stats", description="Show the bot's performance metrics")
+@app_commands.default_permissions(administrator=True)
+async def stats(interaction: discord.Interaction):
+    """Displays latency, queue and cache metrics for admins."""
+    registry = metrics.registry
+    embed = discord.Embed(
+        title="Bot Stats",
+        color=discord.Color.dark_teal()
+    )
+
+    loop_lag = registry.histogram("event_loop_lag_seconds")
+    embed.add_field(
+        name="Event Loop",
+        value=(f"Gateway latency {round(client.latency * 1000)}ms\n"
+               f"Lag: {format_latency(loop_lag) if loop_lag else 'no samples yet'}\n"
+               f"Blocked {registry.counter('event_loop_blocked_total')} times"),
+        inline=False
+    )
+
+    command_latency = sorted(registry.histograms("command_latency_seconds").items(), key=lambda item: -item[1].count)
+    lines = [f"/{dict(labels)['command']} ({dict(labels)['status']}): {format_latency(histogram)}" for labels, histogram in command_latency[:8]]
+    embed.add_field(name="Commands", value="\n".join(lines) or "No commands recorded yet.", inline=False)
+
+    external_calls = sorted(registry.histograms("external_call_seconds").items())
+    lines = [f"{dict(labels)['service']}: {format_latency(histogram)}" for labels, histogram in external_calls]
+    first_token = registry.histogram("ai_first_token_seconds")
+    if first_token:
+        lines.append(f"gemini first token: {format_latency(first_token)}")
+    embed.add_field(name="External Calls", value="\n".join(lines) or "No calls recorded yet.", inline=False)
+
+    guild_id = interaction.guild.id
+    player = players.find(guild_id)
+    prefetch_hits = registry.counter("track_prefetch_total", guild=guild_id, result="hit")
+    prefetch_misses = registry.counter("track_prefetch_total", guild=guild_id, result="miss")
+    embed.add_field(
+        name="Music",
+        value=(f"Active players: {len(players)}, songs queued: {sum(len(p) for p in players)}\n"
+               f"This server's queue: {len(player) if player else 0}\n"
+               f"Songs ready before they played here: {hit_rate(prefetch_hits, prefetch_misses)}"),
+        inline=False
+    )
+    embed.add_field(
+        name="Caches",
+        value=(f"Search cache: {hit_rate(search_cache.hits, search_cache.misses)}\n"
+               f"Opus files: {hit_rate(opus_cache.hits, opus_cache.misses) if opus_cache else 'disabled'}\n"
+               f"AI responses: {hit_rate(ai_client.cache.hits, ai_client.cache.misses)}\n"
+               f"Wikipedia pool: {len(wiki_pool)} articles"),
+        inline=False
+    )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
 @client.tree.command(name="userinfo", description="Get information about a user")
 @app_commands.describe(user="The user to get information about (leave blank for yourself)")
 async def userinfo(interaction: discord.Interaction, user: discord.User = None):
@@ -437,4 +853,13 @@ async def avatar(interaction: discord.Interaction, user: discord.User = None):
     await interaction.response.send_message(embed=embed)
 
 if __name__ == "__main__":
-    client.run(TOKEN)
\ No newline at end of file
+    try:
+        client.run(TOKEN)
+    finally:
+        loop_monitor.stop()
+        resolver.shutdown()
+        audio_hub.close()
+        if opus_cache:
+            opus_cache.shutdown()
+        search_cache.close()
+        level_store.close()  # Write out any EXP still waiting for the next periodic flush
\ No newline at end of file
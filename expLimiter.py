@@ -0,0 +1,103 @@
+import time
+import asyncio
+import metrics
+from array import array
+from messageChunks import split_message
+
+# Bucket times are stored in tenths of a second since the limiter started
+TICKS_PER_SECOND = 10
+# Shortest refill time a bucket can have, one tick
+MIN_REFILL_SECONDS = 1 / TICKS_PER_SECOND
+MAX_TICK = 2 ** 32 - 1
+
+
+class ExpLimiter:
+    """Per-user token buckets deciding which messages earn EXP, configurable per guild.
+
+    Each bucket holds up to burst tokens and regains one every refill_seconds; a
+    message earns EXP only if it can take a token. Buckets are tracked with GCRA,
+    which needs a single number per user: the time at which their bucket will be
+    full again. Those numbers live in one fixed-size array of 32-bit integers
+    indexed by a hash of (guild, user), so memory stays at 4 bytes per slot however
+    many users are seen. Users whose hashes collide share a bucket, which with
+    millions of slots only ever affects a handful of very active users.
+    """
+
+    def __init__(self, burst=3, refill_seconds=20.0, slots=1 << 22):
+        if slots & (slots - 1):
+            raise ValueError("slots must be a power of two")
+        self._mask = slots - 1
+        self._tat = array('I', bytes(4 * slots))  # Theoretical arrival time per slot, in ticks
+        self._epoch = time.monotonic()
+        self._default = self._parameters(burst, refill_seconds)
+        self._guilds = {}  # guild_id -> (interval, tolerance) in ticks, for guilds with their own settings
+
+    @staticmethod
+    def _parameters(burst, refill_seconds):
+        if refill_seconds <= 0:
+            return 0, 0
+        # Never let a short refill time round down to 0, which would turn limiting off
+        interval = max(1, round(refill_seconds * TICKS_PER_SECOND))
+        return interval, interval * (burst - 1)
+
+    def configure(self, guild_id, burst, refill_seconds):
+        """Set a guild's bucket size and refill time; a refill time of 0 turns limiting off there.
+
+        Refill times are rounded to a tenth of a second, with MIN_REFILL_SECONDS the shortest.
+        """
+        self._guilds[guild_id] = self._parameters(burst, refill_seconds)
+
+    def settings(self, guild_id):
+        """Return a guild's (burst, refill_seconds)."""
+        interval, tolerance = self._guilds.get(guild_id, self._default)
+        return (tolerance // interval + 1 if interval else 1), interval / TICKS_PER_SECOND
+
+    def allow(self, guild_id, user_id):
+        """Take a token from the user's bucket; return False if it is empty."""
+        interval, tolerance = self._guilds.get(guild_id, self._default)
+        if not interval:
+            return True
+        now = int((time.monotonic() - self._epoch) * TICKS_PER_SECOND)
+        slot = hash((guild_id, user_id)) & self._mask
+        tat = self._tat[slot]
+        if tat - tolerance > now:
+            metrics.inc("exp_messages_total", result="limited")
+            return False
+        self._tat[slot] = min(max(tat, now) + interval, MAX_TICK)
+        metrics.inc("exp_messages_total", result="awarded")
+        return True
+
+
+class LevelUpAnnouncer:
+    """Collects level-ups per channel and announces them together after a short delay.
+
+    A burst of level-ups in one channel then costs one send (or a few, for very long
+    lists) instead of one per user, and a user who levels up twice is only announced
+    at their latest level.
+    """
+
+    def __init__(self, delay=2.0):
+        self.delay = delay
+        self._pending = {}  # channel_id -> (channel, {user_id: level})
+        self._tasks = set()
+
+    def announce(self, channel, user_id, level):
+        """Queue a level-up announcement; must be called on the event loop."""
+        entry = self._pending.get(channel.id)
+        if entry is None:
+            entry = self._pending[channel.id] = (channel, {})
+            task = asyncio.create_task(self._flush_later(channel.id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        levels = entry[1]
+        levels[user_id] = max(level, levels.get(user_id, 0))
+
+    async def _flush_later(self, channel_id):
+        await asyncio.sleep(self.delay)
+        channel, levels = self._pending.pop(channel_id)
+        lines = [f"🎉 <@{user_id}> leveled up to **Level {level}**!" for user_id, level in levels.items()]
+        try:
+            for chunk in split_message("\n".join(lines)):
+                await channel.send(chunk)
+        except Exception as e:
+            print(f"Error announcing level-ups: {e}")
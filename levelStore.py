@@ -0,0 +1,165 @@
+import sqlite3
+import threading
+from collections import defaultdict
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS levels (
+    guild_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    exp INTEGER NOT NULL DEFAULT 0,
+    level INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (guild_id, user_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS guild_settings (
+    guild_id INTEGER PRIMARY KEY,
+    announcement_channel_id INTEGER,
+    exp_burst INTEGER,
+    exp_refill_seconds REAL
+);
+"""
+
+# Columns added to guild_settings after it was first created, added to older databases on startup
+GUILD_SETTINGS_COLUMNS = {"exp_burst": "INTEGER", "exp_refill_seconds": "REAL"}
+
+
+class LevelStore:
+    """In-memory EXP and levels per server, written behind to SQLite in batches.
+
+    Reads and updates only touch memory. Changed users are remembered and written
+    out together by flush(), so a burst of messages from one user costs one row write.
+
+    When the bot runs as several shard processes sharing one database, owns limits
+    each process to the guilds on its own shards, so no two processes write the same rows.
+    """
+
+    def __init__(self, path, owns=None):
+        self._owns = owns  # Optional guild_id -> bool filter of the guilds this process manages
+        # Other shard processes may hold the write lock briefly; wait for them rather than failing
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._migrate()
+        self._levels = defaultdict(dict)  # guild_id -> user_id -> {"exp": ..., "level": ...}
+        self._dirty = set()  # (guild_id, user_id) pairs changed since the last flush
+        self._announcement_channels = {}  # guild_id -> channel_id for level-up announcements
+        self._exp_cooldowns = {}  # guild_id -> (burst, refill_seconds) for guilds with their own EXP cooldown
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._load()
+
+    def _migrate(self):
+        """Add guild_settings columns missing from databases created by older versions."""
+        existing = {row[1] for row in self._db.execute("PRAGMA table_info(guild_settings)")}
+        for column, column_type in GUILD_SETTINGS_COLUMNS.items():
+            if column in existing:
+                continue
+            try:
+                with self._db:
+                    self._db.execute(f"ALTER TABLE guild_settings ADD COLUMN {column} {column_type}")
+            except sqlite3.OperationalError as e:
+                # Another shard process starting at the same time may have just added it
+                if "duplicate column" not in str(e):
+                    raise
+
+    def _load(self):
+        """Read every stored user of the guilds this process manages into memory."""
+        owns = self._owns or (lambda guild_id: True)
+        for guild_id, user_id, exp, level in self._db.execute("SELECT guild_id, user_id, exp, level FROM levels"):
+            if owns(guild_id):
+                self._levels[guild_id][user_id] = {"exp": exp, "level": level}
+        settings = self._db.execute("SELECT guild_id, announcement_channel_id, exp_burst, exp_refill_seconds FROM guild_settings")
+        for guild_id, channel_id, exp_burst, exp_refill_seconds in settings:
+            if not owns(guild_id):
+                continue
+            if channel_id is not None:
+                self._announcement_channels[guild_id] = channel_id
+            if exp_burst is not None and exp_refill_seconds is not None:
+                self._exp_cooldowns[guild_id] = (exp_burst, exp_refill_seconds)
+
+    def get(self, guild_id, user_id):
+        """Return a user's EXP and level without creating an entry for them."""
+        return self._levels[guild_id].get(user_id) or {"exp": 0, "level": 1}
+
+    def guild(self, guild_id):
+        """Return the user_id -> data mapping for a server."""
+        return self._levels[guild_id]
+
+    def add_exp(self, guild_id, user_id, amount):
+        """Add EXP to a user and return their (mutable) data."""
+        user_data = self._levels[guild_id].get(user_id)
+        if user_data is None:
+            user_data = self._levels[guild_id][user_id] = {"exp": 0, "level": 1}
+        user_data["exp"] += amount
+        self.mark_dirty(guild_id, user_id)
+        return user_data
+
+    def announcement_channel(self, guild_id):
+        """Return the configured level-up announcement channel ID for a server, or None."""
+        return self._announcement_channels.get(guild_id)
+
+    def set_announcement_channel(self, guild_id, channel_id):
+        """Configure where level-ups are announced in a server. Writes immediately."""
+        self._announcement_channels[guild_id] = channel_id
+        with self._write_lock, self._db:
+            self._db.execute(
+                "INSERT INTO guild_settings (guild_id, announcement_channel_id) VALUES (?, ?) "
+                "ON CONFLICT (guild_id) DO UPDATE SET announcement_channel_id = excluded.announcement_channel_id",
+                (guild_id, channel_id),
+            )
+
+    def exp_cooldowns(self):
+        """Return {guild_id: (burst, refill_seconds)} for every guild with its own EXP cooldown."""
+        return dict(self._exp_cooldowns)
+
+    def set_exp_cooldown(self, guild_id, burst, refill_seconds):
+        """Configure a server's EXP cooldown. Writes immediately."""
+        self._exp_cooldowns[guild_id] = (burst, refill_seconds)
+        with self._write_lock, self._db:
+            self._db.execute(
+                "INSERT INTO guild_settings (guild_id, exp_burst, exp_refill_seconds) VALUES (?, ?, ?) "
+                "ON CONFLICT (guild_id) DO UPDATE SET exp_burst = excluded.exp_burst, "
+                "exp_refill_seconds = excluded.exp_refill_seconds",
+                (guild_id, burst, refill_seconds),
+            )
+
+    def mark_dirty(self, guild_id, user_id):
+        """Queue a user's current data to be written on the next flush."""
+        with self._lock:
+            self._dirty.add((guild_id, user_id))
+
+    def collect(self):
+        """Snapshot the rows changed since the last call; run this on the event loop thread."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        rows = []
+        for guild_id, user_id in dirty:
+            user_data = self._levels[guild_id][user_id]
+            rows.append((guild_id, user_id, user_data["exp"], user_data["level"]))
+        return rows
+
+    def write(self, rows):
+        """Write a snapshot from collect() in one transaction; safe to call from a worker thread."""
+        if not rows:
+            return
+        try:
+            with self._write_lock, self._db:
+                self._db.executemany(
+                    "INSERT INTO levels (guild_id, user_id, exp, level) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (guild_id, user_id) DO UPDATE SET exp = excluded.exp, level = excluded.level",
+                    rows,
+                )
+        except sqlite3.Error:
+            # Put the users back so the next flush retries them
+            with self._lock:
+                self._dirty.update((guild_id, user_id) for guild_id, user_id, _, _ in rows)
+            raise
+
+    def flush(self):
+        """Write all pending changes synchronously."""
+        self.write(self.collect())
+
+    def close(self):
+        """Flush pending changes and close the database."""
+        self.flush()
+        self._db.close()
@@ -0,0 +1,114 @@
+import re
+import time
+
+DISCORD_MESSAGE_LIMIT = 2000
+FENCE = "```"
+# What may follow an opening fence as the code block's language, e.g. ```python
+FENCE_LANGUAGE = re.compile(r"[\w+#.-]{1,20}")
+# Smallest limit that leaves room to close and reopen a code block and still make progress
+MIN_LIMIT = 32
+
+# Places to split a long message, best first, with how many separator characters to drop
+SPLIT_POINTS = (("\n\n", 2), ("\n", 1), (". ", 1), (" ", 1))
+
+
+def _split_point(window):
+    """Return (cut, skip) for the best place to end a chunk within window."""
+    for separator, skip in SPLIT_POINTS:
+        index = window.rfind(separator)
+        # Don't accept a split that would leave a tiny chunk behind
+        if index >= len(window) // 2:
+            if separator == ". ":
+                return index + 1, skip
+            return index, skip
+    return len(window), 0
+
+
+def _reopening_fence(chunk):
+    """Return the fence that reopens the code block left open at the end of chunk."""
+    first_line, newline, _ = chunk[chunk.rfind(FENCE) + len(FENCE):].partition("\n")
+    # Only a short identifier on the fence's own line is a language; anything else is code
+    if newline and FENCE_LANGUAGE.fullmatch(first_line):
+        return f"{FENCE}{first_line}\n"
+    return FENCE + "\n"
+
+
+def split_message(text, limit=DISCORD_MESSAGE_LIMIT):
+    """Split text into chunks of at most limit characters on markdown-friendly boundaries.
+
+    Splits prefer paragraph breaks, then line breaks, sentences and words. A code
+    block that spans a split is closed at the end of one chunk and reopened, with
+    the same language, at the start of the next.
+    """
+    if limit < MIN_LIMIT:
+        raise ValueError(f"limit must be at least {MIN_LIMIT}")
+    chunks = []
+    while len(text) > limit:
+        # Leave room to close a code block that is still open at the split
+        window = text[:limit - len(FENCE) - 1]
+        cut, skip = _split_point(window)
+        if not skip:
+            # A hard cut mustn't land inside a fence
+            for back in (1, 2):
+                if text[cut - back:cut - back + len(FENCE)] == FENCE:
+                    cut -= back
+                    break
+        chunk, rest = text[:cut], text[cut + skip:]
+
+        if chunk.count(FENCE) % 2:
+            chunk += "\n" + FENCE
+            reopen = _reopening_fence(chunk[:-len(FENCE) - 1])
+            # Every pass has to leave less text than it started with
+            if len(reopen) + len(rest) >= len(text):
+                reopen = FENCE + "\n"
+            rest = reopen + rest
+        chunks.append(chunk)
+        text = rest
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+class StreamingReply:
+    """Shows streamed text in Discord as it arrives.
+
+    The newest message is edited at most once per interval seconds, and new messages
+    are sent as the text grows past the Discord limit. send is a coroutine function
+    that posts a message and returns it, so it can be edited later.
+    """
+
+    CURSOR = " ▌"
+
+    def __init__(self, send, interval=1.0, limit=DISCORD_MESSAGE_LIMIT):
+        self._send = send
+        self.interval = interval
+        self.limit = limit - len(self.CURSOR)
+        self.text = ""
+        self.messages = []
+        self._shown = []  # Content currently displayed in each message
+        self._last_render = None
+
+    async def feed(self, piece):
+        """Add streamed text, updating Discord if the last update is old enough."""
+        self.text += piece
+        # The first piece is shown straight away so users see the reply start
+        if self._last_render is None or time.monotonic() - self._last_render >= self.interval:
+            await self._render(final=False)
+
+    async def finish(self):
+        """Show the complete text."""
+        await self._render(final=True)
+
+    async def _render(self, final):
+        self._last_render = time.monotonic()
+        chunks = split_message(self.text, self.limit) or ["*No response.*"]
+        for index, chunk in enumerate(chunks):
+            if not final and index == len(chunks) - 1:
+                chunk += self.CURSOR
+            if index < len(self.messages):
+                if self._shown[index] != chunk:
+                    await self.messages[index].edit(content=chunk)
+                    self._shown[index] = chunk
+            else:
+                self.messages.append(await self._send(chunk))
+                self._shown.append(chunk)
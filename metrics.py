@@ -0,0 +1,254 @@
+import sys
+import time
+import asyncio
+import threading
+import traceback
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Upper bounds, in seconds, of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join(f'{name}="{str(value)}"'.replace("\n", " ") for name, value in pairs)
+    return "{" + body + "}"
+
+
+class Histogram:
+    """Counts observations into fixed buckets, Prometheus style."""
+
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating within the bucket it falls in."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        lower = 0.0
+        for index, bucket_count in enumerate(self.counts):
+            upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+            if bucket_count and seen + bucket_count >= target:
+                return lower + (upper - lower) * (target - seen) / bucket_count
+            seen += bucket_count
+            lower = upper
+        return self.buckets[-1]
+
+
+class Registry:
+    """Holds counters, gauges and histograms, keyed by name and labels."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}  # name -> {label key: value}
+        self._gauges = {}
+        self._histograms = {}
+        self._collectors = []  # Callables returning (name, labels, value) gauge samples at scrape time
+        self._collected = {}  # collector -> {name: {label key: value}} from its latest run
+
+    def inc(self, name, value=1, **labels):
+        """Add to a counter."""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        """Set a gauge to a value."""
+        with self._lock:
+            self._gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    def observe(self, name, value, **labels):
+        """Record a value in a histogram."""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def histogram(self, name, **labels):
+        """Return the histogram for a name and labels, or None if nothing was observed."""
+        return self._histograms.get(name, {}).get(_label_key(labels))
+
+    def histograms(self, name):
+        """Return {label pairs: histogram} for every series of a histogram."""
+        with self._lock:
+            return dict(self._histograms.get(name, {}))
+
+    def counter(self, name, **labels):
+        """Return a counter's current value."""
+        return self._counters.get(name, {}).get(_label_key(labels), 0)
+
+    def add_collector(self, collector):
+        """Register a callable that reports gauge samples whenever metrics are read."""
+        self._collectors.append(collector)
+
+    def collect(self):
+        """Run the collectors, replacing each one's samples so series it stopped reporting disappear."""
+        for collector in self._collectors:
+            samples = {}
+            try:
+                for name, labels, value in collector():
+                    samples.setdefault(name, {})[_label_key(labels)] = value
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+                continue  # Keep its previous samples rather than a partial set
+            with self._lock:
+                self._collected[collector] = samples
+
+    def _all_gauges(self):
+        """Return set gauges merged with the collectors' latest samples; called with the lock held."""
+        gauges = {name: dict(series) for name, series in self._gauges.items()}
+        for samples in self._collected.values():
+            for name, series in samples.items():
+                gauges.setdefault(name, {}).update(series)
+        return gauges
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        self.collect()
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                lines.extend(f"{name}{_format_labels(key)} {value}" for key, value in series.items())
+            for name, series in sorted(self._all_gauges().items()):
+                lines.append(f"# TYPE {name} gauge")
+                lines.extend(f"{name}{_format_labels(key)} {value}" for key, value in series.items())
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, bucket_count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                        cumulative += bucket_count
+                        lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {histogram.sum}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+# The process-wide registry used by the module-level helpers below
+registry = Registry()
+inc = registry.inc
+set_gauge = registry.set_gauge
+observe = registry.observe
+add_collector = registry.add_collector
+render = registry.render
+
+
+@contextmanager
+def timed(name, **labels):
+    """Observe how long the with-block takes, in seconds. Works in threads and coroutines."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+class LoopMonitor:
+    """Measures event loop lag and reports when the loop is blocked.
+
+    A coroutine wakes up every interval seconds and records how late it was. A
+    watchdog thread checks that the coroutine keeps waking up; if the loop stalls
+    for longer than block_threshold it counts a blocked loop and prints the stack
+    the loop thread is stuck in.
+    """
+
+    def __init__(self, interval=0.5, block_threshold=1.0):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self._last_beat = time.monotonic()
+        self._loop_thread = None
+        self._task = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Start monitoring the running event loop."""
+        if self._task is not None and not self._task.done():
+            return
+        self._loop_thread = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._task = asyncio.create_task(self._beat())
+        if self._watchdog is None:
+            self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._watchdog.start()
+
+    def stop(self):
+        """Stop monitoring."""
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _beat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            observe("event_loop_lag_seconds", max(0.0, now - expected))
+            self._last_beat = now
+
+    def _watch(self):
+        reported = False
+        while not self._stopped.wait(self.block_threshold / 2):
+            stalled = time.monotonic() - self._last_beat - self.interval
+            if stalled < self.block_threshold:
+                reported = False
+                continue
+            if reported:
+                continue
+            # Report each stall once, with where the loop thread is stuck
+            reported = True
+            inc("event_loop_blocked_total")
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = "".join(traceback.format_stack(frame)) if frame else "(stack unavailable)\n"
+            print(f"⚠️ Event loop blocked for {stalled:.2f}s at:\n{stack}", end="")
+
+
+async def _handle_scrape(reader, writer):
+    try:
+        request_line = await reader.readline()
+        # Drain the request headers
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        path = request_line.split(b" ")[1] if request_line.count(b" ") >= 2 else b"/"
+        if path.split(b"?")[0] in (b"/", b"/metrics"):
+            status, body = "200 OK", render().encode()
+        else:
+            status, body = "404 Not Found", b"Not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except Exception as e:
+        print(f"Error serving metrics: {e}")
+    finally:
+        writer.close()
+
+
+async def serve(host="127.0.0.1", port=9108):
+    """Serve the registry as Prometheus text on http://host:port/metrics."""
+    return await asyncio.start_server(_handle_scrape, host, port)
@@ -0,0 +1,123 @@
+import asyncio
+import random
+from itertools import islice
+from collections import deque
+
+
+class GuildPlayer:
+    """Holds the song queue, lock and playback state for a single guild."""
+
+    def __init__(self, guild_id, advance):
+        self.guild_id = guild_id
+        self.queue = deque()
+        self.lock = asyncio.Lock()
+        self.voice_client = None
+        self.text_channel = None
+        self.loop = None
+        self.stopped = False
+        self.loaders = set()  # Background tasks still adding songs to the queue
+        self._advance = advance  # Coroutine function that starts the next song for this player
+
+    def __len__(self):
+        return len(self.queue)
+
+    def bind(self, voice_client, text_channel):
+        """Attach the voice client and text channel the player should use."""
+        self.voice_client = voice_client
+        self.text_channel = text_channel
+        self.loop = asyncio.get_running_loop()
+        self.stopped = False
+
+    def enqueue(self, song):
+        """Add a single song to the end of the queue and return its position."""
+        self.queue.append(song)
+        return len(self.queue)
+
+    def extend(self, songs):
+        """Add several songs to the end of the queue."""
+        self.queue.extend(songs)
+
+    def next_song(self):
+        """Pop the next song off the queue, or return None if it is empty."""
+        if not self.queue:
+            return None
+        return self.queue.popleft()
+
+    def upcoming(self, count):
+        """Return the next few songs without removing them from the queue."""
+        return list(islice(self.queue, count))
+
+    def shuffle(self):
+        """Shuffle the queue in place."""
+        songs = list(self.queue)
+        random.shuffle(songs)
+        self.queue.clear()
+        self.queue.extend(songs)
+
+    def is_active(self):
+        """Return True if the voice client is currently playing or paused."""
+        vc = self.voice_client
+        return vc is not None and (vc.is_playing() or vc.is_paused())
+
+    def start_loader(self, coro):
+        """Run a coroutine that fills the queue in the background, tied to this player."""
+        task = asyncio.create_task(coro)
+        self.loaders.add(task)
+        task.add_done_callback(self.loaders.discard)
+        return task
+
+    def is_loading(self):
+        """Return True while background loaders may still add songs."""
+        return bool(self.loaders)
+
+    def skip(self):
+        """Stop the current song so the after callback advances the queue."""
+        if self.voice_client is not None:
+            self.voice_client.stop()
+
+    def stop(self):
+        """Clear the queue and stop advancing to the next song."""
+        self.stopped = True
+        for task in list(self.loaders):
+            task.cancel()
+        self.queue.clear()
+
+    def after_playing(self, error):
+        """Voice client callback; runs on the audio thread when a song ends."""
+        if error:
+            print(f"Error during playback in guild {self.guild_id}: {error}")
+        if self.stopped or self.loop is None or self.loop.is_closed():
+            return
+        asyncio.run_coroutine_threadsafe(self._advance(self), self.loop)
+
+
+class PlayerRegistry:
+    """Creates and tracks one GuildPlayer per guild."""
+
+    def __init__(self, advance):
+        self._advance = advance
+        self._players = {}
+
+    def __iter__(self):
+        return iter(self._players.values())
+
+    def __len__(self):
+        return len(self._players)
+
+    def get(self, guild_id):
+        """Return the player for a guild, creating it on first use."""
+        player = self._players.get(guild_id)
+        if player is None:
+            player = self._players[guild_id] = GuildPlayer(guild_id, self._advance)
+        return player
+
+    def find(self, guild_id):
+        """Return the player for a guild if one exists."""
+        return self._players.get(guild_id)
+
+    def remove(self, guild_id):
+        """Stop and forget the player for a guild."""
+        player = self._players.pop(guild_id, None)
+        if player is not None:
+            player.stop()
+        return player
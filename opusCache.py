@@ -0,0 +1,222 @@
+import os
+import re
+import time
+import shlex
+import sqlite3
+import threading
+import subprocess
+import metrics
+from concurrent.futures import ThreadPoolExecutor
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    video_id TEXT PRIMARY KEY,
+    plays INTEGER NOT NULL DEFAULT 0,
+    last_played REAL NOT NULL,
+    size INTEGER  -- Bytes on disk, NULL while the track isn't cached
+);
+CREATE INDEX IF NOT EXISTS tracks_eviction ON tracks (plays, last_played) WHERE size IS NOT NULL;
+"""
+
+# Encode to the Ogg Opus layout Discord expects, so cached files can be sent without transcoding
+ENCODE_OPTIONS = (
+    '-vn', '-map_metadata', '-1', '-c:a', 'libopus', '-b:a', '128k',
+    '-ar', '48000', '-ac', '2', '-f', 'opus', '-loglevel', 'error',
+)
+# Give up on an encode that takes longer than this, in seconds
+ENCODE_TIMEOUT = 15 * 60
+# Play counts of tracks that were never cached are forgotten after this long without a play
+STALE_AFTER = 30 * 24 * 60 * 60
+# YouTube video IDs; anything else isn't used as a file name
+VIDEO_ID = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+class OpusCache:
+    """On-disk cache of Opus-encoded tracks, keyed by YouTube video ID.
+
+    Every play is counted. Once a track has been played threshold times, it is
+    encoded to Opus in the background. Later plays then read the local file
+    instead of streaming it again. When the files outgrow max_bytes, the least
+    played tracks are deleted, with the least recently played going first on a tie.
+    """
+
+    def __init__(self, directory, max_bytes, threshold=3, workers=1, before_options=None, executable="ffmpeg"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.threshold = threshold
+        self.before_options = before_options
+        self.executable = executable
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        # _lock only guards the in-memory state below and is never held during I/O, since
+        # lookups take it on the event loop; _db_lock serialises the index and file deletions
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, "index.db"), check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._files = {}  # video_id -> size in bytes, for tracks on disk
+        self._encoding = set()  # video IDs being encoded right now
+        self._processes = set()  # Running FFmpeg encodes, killed on shutdown
+        self._closed = False
+        # Play counts are written by one thread in order; encodes get their own pool
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="opus-cache-writer")
+        self._encoder = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="opus-cache-encoder")
+        self._load()
+
+    def __len__(self):
+        return len(self._files)
+
+    def _path(self, video_id):
+        return os.path.join(self.directory, f"{video_id}.opus")
+
+    def _load(self):
+        """Read which tracks are on disk, dropping index rows for missing files and leftover partial encodes."""
+        with self._db_lock, self._db:
+            for video_id, size in self._db.execute("SELECT video_id, size FROM tracks WHERE size IS NOT NULL").fetchall():
+                if os.path.exists(self._path(video_id)):
+                    with self._lock:
+                        self._files[video_id] = size
+                else:
+                    self._db.execute("UPDATE tracks SET size = NULL WHERE video_id = ?", (video_id,))
+            self._db.execute("DELETE FROM tracks WHERE size IS NULL AND last_played <= ?", (time.time() - STALE_AFTER,))
+        # Other shard processes may share the directory, so only clear out encodes too old to still be running
+        for name in os.listdir(self.directory):
+            partial = os.path.join(self.directory, name)
+            if name.endswith(".part") and os.path.getmtime(partial) < time.time() - ENCODE_TIMEOUT:
+                os.remove(partial)
+
+    def size(self):
+        """Return how many bytes of audio are cached."""
+        with self._lock:
+            return sum(self._files.values())
+
+    def lookup(self, video_id):
+        """Return the path of a cached track, or None if it isn't cached."""
+        with self._lock:
+            cached = video_id in self._files
+        path = self._path(video_id) if cached else None
+        if path is not None and not os.path.exists(path):
+            # Deleted behind our back; forget it so it can be cached again
+            with self._lock:
+                self._files.pop(video_id, None)
+            path = None
+        if path is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return path
+
+    def record_play(self, video_id, url):
+        """Count a play of a track, caching it in the background once it is popular enough."""
+        if VIDEO_ID.fullmatch(video_id or ""):
+            self._writer.submit(self._record, video_id, url)
+
+    def _record(self, video_id, url):
+        now = time.time()
+        try:
+            with self._db_lock, self._db:
+                self._db.execute(
+                    "INSERT INTO tracks (video_id, plays, last_played) VALUES (?, 1, ?) "
+                    "ON CONFLICT (video_id) DO UPDATE SET plays = plays + 1, last_played = excluded.last_played",
+                    (video_id, now),
+                )
+                plays, size = self._db.execute("SELECT plays, size FROM tracks WHERE video_id = ?", (video_id,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"Error counting a play of {video_id}: {e}")
+            return
+        on_disk = size is not None and os.path.exists(self._path(video_id))
+        with self._lock:
+            if on_disk and video_id not in self._files:
+                # Another shard process already cached it
+                self._files[video_id] = size
+            if plays < self.threshold or video_id in self._files or video_id in self._encoding:
+                return
+            self._encoding.add(video_id)
+        self._encoder.submit(self._encode, video_id, url)
+
+    def _encode(self, video_id, url):
+        """Download and encode a track to Opus, then make room for it under the size budget."""
+        path = self._path(video_id)
+        partial = f"{path}.{os.getpid()}.part"
+        args = [self.executable, *shlex.split(self.before_options or ''), '-i', url, *ENCODE_OPTIONS, '-y', partial]
+        try:
+            with metrics.timed("opus_cache_encode_seconds"):
+                self._run(args)
+            size = os.path.getsize(partial)
+            os.replace(partial, path)
+        except (OSError, subprocess.SubprocessError) as e:
+            metrics.inc("opus_cache_encodes_total", result="error")
+            print(f"Error caching {video_id} as Opus: {e}")
+            if os.path.exists(partial):
+                os.remove(partial)
+            with self._lock:
+                self._encoding.discard(video_id)
+            return
+
+        metrics.inc("opus_cache_encodes_total", result="ok")
+        with self._lock:
+            self._encoding.discard(video_id)
+            self._files[video_id] = size
+        try:
+            with self._db_lock, self._db:
+                self._db.execute("UPDATE tracks SET size = ? WHERE video_id = ?", (size, video_id))
+                self._evict(keep=video_id)
+        except sqlite3.Error as e:
+            print(f"Error indexing cached track {video_id}: {e}")
+
+    def _run(self, args):
+        """Run FFmpeg, raising if it fails or runs past ENCODE_TIMEOUT."""
+        process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        with self._lock:
+            if self._closed:
+                process.kill()
+            self._processes.add(process)
+        try:
+            _, stderr = process.communicate(timeout=ENCODE_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            raise
+        finally:
+            with self._lock:
+                self._processes.discard(process)
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, args, stderr=stderr)
+
+    def _evict(self, keep=None):
+        """Delete the least played cached tracks until the cache fits its budget; called with _db_lock held."""
+        # Shard processes share the directory, so the budget covers what all of them cached
+        (total,) = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM tracks").fetchone()
+        if total <= self.max_bytes:
+            return
+        rows = self._db.execute(
+            "SELECT video_id, size FROM tracks WHERE size IS NOT NULL ORDER BY plays, last_played"
+        ).fetchall()
+        for video_id, size in rows:
+            if total <= self.max_bytes:
+                break
+            if video_id == keep:
+                continue
+            try:
+                os.remove(self._path(video_id))
+            except FileNotFoundError:
+                pass
+            with self._lock:
+                self._files.pop(video_id, None)
+            self._db.execute("UPDATE tracks SET size = NULL WHERE video_id = ?", (video_id,))
+            metrics.inc("opus_cache_evictions_total")
+            total -= size
+
+    def shutdown(self):
+        """Stop background work and close the index. Encodes in progress are abandoned."""
+        self._writer.shutdown(wait=True)
+        with self._lock:
+            self._closed = True
+            for process in self._processes:
+                process.kill()
+        self._encoder.shutdown(wait=True, cancel_futures=True)
+        with self._db_lock:
+            self._db.close()
@@ -0,0 +1,103 @@
+import asyncio
+import yt_dlp
+import metrics
+
+SPOTIFY_PAGE_SIZE = 100
+YOUTUBE_BATCH_SIZE = 50
+
+# Playlist entries are only listed here; each one is fully resolved shortly before it plays
+YOUTUBE_FLAT_OPTS = {
+    'quiet': True,
+    'extract_flat': 'in_playlist',
+    'lazy_playlist': True,
+}
+
+
+def spotify_page_songs(items):
+    """Turn a page of Spotify playlist items into (queue entries, display names)."""
+    songs = []
+    names = []
+    for item in items:
+        try:
+            track_name = item['track']['name']
+            artist_name = item['track']['artists'][0]['name']
+            songs.append(f"{track_name} {artist_name}")
+            names.append(f"{track_name} by {artist_name}")
+        except (KeyError, TypeError, IndexError):
+            # Skip tracks with missing or invalid metadata
+            print(f"Skipping an unavailable track in the playlist: {item}")
+    return songs, names
+
+
+def spotify_playlist_pages(spotify, url, offset=0):
+    """Yield pages of queue entries from a Spotify playlist, starting at offset.
+
+    Every call to the Spotify API blocks, so this generator is meant to be driven
+    from a worker thread with iterate_in_thread.
+    """
+    while True:
+        with metrics.timed("external_call_seconds", service="spotify"):
+            playlist_items = spotify.playlist_items(url, offset=offset, limit=SPOTIFY_PAGE_SIZE)
+        songs, _ = spotify_page_songs(playlist_items['items'])
+        if songs:
+            yield songs
+        if not playlist_items['next']:
+            return
+        offset += SPOTIFY_PAGE_SIZE
+
+
+def open_youtube_url(url):
+    """Extract a YouTube URL without resolving the entries of a playlist.
+
+    Returns (info, batches). For a single video info is fully resolved and batches
+    is None; for a playlist batches is a blocking generator of (link, title) lists
+    that pages through the playlist as it is consumed.
+    """
+    ydl = yt_dlp.YoutubeDL(YOUTUBE_FLAT_OPTS)
+    try:
+        with metrics.timed("external_call_seconds", service="yt-dlp"):
+            info = ydl.extract_info(url, download=False, process=False)
+            # Watch links with a list parameter redirect to the playlist itself
+            while info.get('_type') in ('url', 'url_transparent'):
+                info = ydl.extract_info(info['url'], download=False, process=False)
+            if info.get('_type') != 'playlist':
+                info = ydl.process_ie_result(info, download=False)
+                ydl.close()
+                return info, None
+    except Exception:
+        ydl.close()
+        raise
+    return info, youtube_entry_batches(ydl, info['entries'])
+
+
+def youtube_entry_batches(ydl, entries, size=YOUTUBE_BATCH_SIZE):
+    """Yield lists of (link, title) pairs from flat playlist entries, closing ydl when done."""
+    try:
+        batch = []
+        for entry in entries:
+            if not entry:
+                continue
+            link = entry.get('webpage_url') or entry.get('url')
+            if not link or not link.startswith(("http://", "https://")):
+                if not entry.get('id'):
+                    continue
+                link = f"https://www.youtube.com/watch?v={entry['id']}"
+            batch.append((link, entry.get('title') or link))
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        ydl.close()
+
+
+async def iterate_in_thread(iterable):
+    """Drive a blocking iterator in a worker thread and yield its items on the event loop."""
+    iterator = iter(iterable)
+    done = object()
+    while True:
+        item = await asyncio.to_thread(next, iterator, done)
+        if item is done:
+            return
+        yield item
@@ -0,0 +1,109 @@
+from bisect import bisect_left, insort
+
+# Keys per chunk; chunks split at twice this size so inserts only shift a small list
+CHUNK_SIZE = 512
+
+
+class GuildRanking:
+    """Users of one server ordered by EXP, highest first.
+
+    Entries are (-exp, user_id) keys kept in a list of sorted chunks, so an update
+    only shifts one short chunk and a rank lookup only walks the chunk boundaries.
+    """
+
+    def __init__(self, scores=()):
+        keys = sorted((-exp, user_id) for user_id, exp in scores)
+        self._chunks = [keys[i:i + CHUNK_SIZE] for i in range(0, len(keys), CHUNK_SIZE)] or [[]]
+        self._maxes = [chunk[-1] for chunk in self._chunks if chunk]
+        self._exp = {user_id: -key for key, user_id in keys}
+
+    def __len__(self):
+        return len(self._exp)
+
+    def _locate(self, key):
+        """Return the index of the chunk that key belongs in."""
+        index = bisect_left(self._maxes, key)
+        return min(index, len(self._chunks) - 1)
+
+    def _insert(self, key):
+        index = self._locate(key)
+        chunk = self._chunks[index]
+        insort(chunk, key)
+        if len(chunk) > CHUNK_SIZE * 2:
+            halves = [chunk[:CHUNK_SIZE], chunk[CHUNK_SIZE:]]
+            self._chunks[index:index + 1] = halves
+            self._maxes[index:index + 1] = [half[-1] for half in halves]
+        elif index < len(self._maxes):
+            self._maxes[index] = chunk[-1]
+        else:
+            self._maxes.append(chunk[-1])
+
+    def _remove(self, key):
+        index = self._locate(key)
+        chunk = self._chunks[index]
+        del chunk[bisect_left(chunk, key)]
+        if chunk:
+            self._maxes[index] = chunk[-1]
+        else:
+            del self._maxes[index]
+            # Keep a single empty chunk around so there is always somewhere to insert
+            if len(self._chunks) > 1:
+                del self._chunks[index]
+
+    def update(self, user_id, exp):
+        """Record a user's new EXP total."""
+        old = self._exp.get(user_id)
+        if old == exp:
+            return
+        if old is not None:
+            self._remove((-old, user_id))
+        self._insert((-exp, user_id))
+        self._exp[user_id] = exp
+
+    def rank(self, user_id):
+        """Return a user's 1-based position, or None if they have no EXP yet."""
+        exp = self._exp.get(user_id)
+        if exp is None:
+            return None
+        key = (-exp, user_id)
+        index = self._locate(key)
+        before = sum(len(chunk) for chunk in self._chunks[:index])
+        return before + bisect_left(self._chunks[index], key) + 1
+
+    def page(self, start, count):
+        """Return (user_id, exp) pairs for positions start+1 .. start+count."""
+        results = []
+        for chunk in self._chunks:
+            if start >= len(chunk):
+                start -= len(chunk)
+                continue
+            for neg_exp, user_id in chunk[start:start + count - len(results)]:
+                results.append((user_id, -neg_exp))
+            start = 0
+            if len(results) >= count:
+                break
+        return results
+
+
+class RankIndex:
+    """Keeps a GuildRanking per server, built lazily from the level store."""
+
+    def __init__(self, level_store):
+        self._level_store = level_store
+        self._guilds = {}
+
+    def guild(self, guild_id):
+        """Return the ranking for a server, building it on first use."""
+        ranking = self._guilds.get(guild_id)
+        if ranking is None:
+            users = self._level_store.guild(guild_id)
+            ranking = self._guilds[guild_id] = GuildRanking(
+                (user_id, user_data["exp"]) for user_id, user_data in users.items()
+            )
+        return ranking
+
+    def update(self, guild_id, user_id, exp):
+        """Record a user's new EXP total if the server's ranking has been built."""
+        ranking = self._guilds.get(guild_id)
+        if ranking is not None:
+            ranking.update(user_id, exp)
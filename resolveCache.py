@@ -0,0 +1,101 @@
+import time
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS searches (
+    query TEXT PRIMARY KEY,
+    video_id TEXT NOT NULL,
+    title TEXT,
+    webpage_url TEXT,
+    thumbnail TEXT,
+    duration INTEGER,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS searches_last_used ON searches (last_used);
+"""
+
+
+def normalize_query(query):
+    """Normalize a search string so trivially different spellings share a cache entry."""
+    return " ".join(query.casefold().split())
+
+
+class ResolveCache:
+    """Disk-backed cache mapping ytsearch queries to YouTube video IDs and metadata.
+
+    Entries older than ttl seconds are treated as misses, and the least recently
+    used entries are evicted once the cache grows past max_entries.
+    """
+
+    def __init__(self, path, max_entries=50000, ttl=30 * 24 * 60 * 60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Shard processes share the file, so wait out each other's writes like the other stores do
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def get(self, query):
+        """Return cached metadata for a search query, or None on a miss."""
+        key = normalize_query(query)
+        now = time.time()
+        # A failed statement rolls back, so a busy database never leaves a write transaction open
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT video_id, title, webpage_url, thumbnail, duration, created_at FROM searches WHERE query = ?",
+                (key,),
+            ).fetchone()
+            if row is None or row[5] + self.ttl <= now:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE searches SET last_used = ? WHERE query = ?", (now, key))
+            self.hits += 1
+        return {
+            'video_id': row[0],
+            'title': row[1],
+            'webpage_url': row[2],
+            'thumbnail': row[3],
+            'duration': row[4],
+        }
+
+    def put(self, query, info):
+        """Remember which video a search query resolved to."""
+        if not info.get('id'):
+            return
+        key = normalize_query(query)
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO searches VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, info['id'], info.get('title'), info.get('webpage_url'),
+                 info.get('thumbnail'), info.get('duration'), now, now),
+            )
+            self._evict()
+
+    def delete(self, query):
+        """Forget what a search query resolved to, e.g. because the video is gone."""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM searches WHERE query = ?", (normalize_query(query),))
+
+    def _evict(self):
+        """Drop expired entries and trim the least recently used ones over the size budget."""
+        self._db.execute("DELETE FROM searches WHERE created_at <= ?", (time.time() - self.ttl,))
+        (count,) = self._db.execute("SELECT COUNT(*) FROM searches").fetchone()
+        if count > self.max_entries:
+            # Trim a little below the budget so we don't evict on every insert
+            excess = count - int(self.max_entries * 0.9)
+            self._db.execute(
+                "DELETE FROM searches WHERE query IN (SELECT query FROM searches ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+
+    def close(self):
+        """Close the underlying database."""
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,202 @@
+"""Runs the bot as several processes, each owning a contiguous block of gateway shards.
+
+Each process runs bot.py as an AutoShardedBot limited to its shards, so gateway
+events, leveling and music work for its guilds stay on its own core. The levels
+database is shared, but every process only loads and writes the guilds on its own
+shards. The coordinator staggers start-ups to respect Discord's identify rate
+limit, restarts processes that crash, and stops them all on Ctrl+C.
+
+    python shardLauncher.py                           # Discord's recommended shard count, one process per core
+    python shardLauncher.py --shards 16 --processes 4
+    python shardLauncher.py --fake-gateway --shards 8 --processes 4 -- --messages 50000
+
+With --fake-gateway the processes run benchmark.py against the local fakes instead
+of connecting to Discord, and their results are combined into one report.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import tempfile
+import subprocess
+from sharding import partition
+
+GATEWAY_URL = "https://discord.com/api/v10/gateway/bot"
+# Discord allows max_concurrency identifies per this many seconds
+IDENTIFY_WINDOW = 5
+# Wait this long before restarting a crashed process, doubling per crash up to the maximum
+RESTART_DELAY = 5
+MAX_RESTART_DELAY = 300
+# A process that stays up this long is considered healthy again
+HEALTHY_AFTER = 600
+
+
+def recommended_shards(token):
+    """Ask Discord for the recommended shard count and identify concurrency."""
+    import requests
+    response = requests.get(GATEWAY_URL, headers={"Authorization": f"Bot {token}"}, timeout=10)
+    response.raise_for_status()
+    data = response.json()
+    return data["shards"], data.get("session_start_limit", {}).get("max_concurrency", 1)
+
+
+class ShardProcess:
+    """One child process and the shards it runs."""
+
+    def __init__(self, index, shard_ids, command, env):
+        self.index = index
+        self.shard_ids = shard_ids
+        self.command = command
+        self.env = env
+        self.process = None
+        self.started_at = 0.0
+        self.restart_delay = RESTART_DELAY
+        self.restart_at = None  # When to restart after a crash, if one is pending
+        self.done = False  # Exited and won't be restarted
+
+    def start(self):
+        print(f"🚀 Starting process {self.index} for shards {self.shard_ids[0]}-{self.shard_ids[-1]}")
+        self.process = subprocess.Popen(self.command, env=self.env)
+        self.started_at = time.monotonic()
+
+    def poll(self):
+        return self.process.poll() if self.process else None
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.send_signal(signal.SIGINT)
+
+
+def build_processes(shard_count, processes, command, base_env, metrics_port):
+    """Create a ShardProcess per block of shards, each with its own metrics port."""
+    children = []
+    for index, shard_ids in enumerate(partition(shard_count, processes)):
+        env = dict(base_env)
+        env["SHARD_COUNT"] = str(shard_count)
+        env["SHARD_IDS"] = ",".join(map(str, shard_ids))
+        env["METRICS_PORT"] = str(metrics_port + index if metrics_port else 0)
+        children.append(ShardProcess(index, shard_ids, command(index, shard_ids), env))
+    return children
+
+
+def start_staggered(children, max_concurrency, identify_window=IDENTIFY_WINDOW):
+    """Start processes one after another, leaving time for each one's shards to identify."""
+    for position, child in enumerate(children):
+        if position:
+            previous = children[position - 1]
+            time.sleep(identify_window * -(-len(previous.shard_ids) // max_concurrency))
+        child.start()
+
+
+def supervise(children, restart=True):
+    """Wait for the processes, restarting any that crash, until all have exited or we're interrupted."""
+    stopping = False
+
+    def request_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for child in children:
+            child.stop()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    failures = 0
+    while True:
+        running = 0
+        for child in children:
+            if child.done:
+                continue
+            code = child.poll()
+            if code is None:
+                running += 1
+                if time.monotonic() - child.started_at > HEALTHY_AFTER:
+                    child.restart_delay = RESTART_DELAY
+                continue
+            if stopping or not restart or code == 0:
+                child.done = True
+                if code and not stopping:
+                    failures += 1
+                continue
+            if child.restart_at is None:
+                print(f"⚠️ Process {child.index} exited with code {code}; restarting in {child.restart_delay}s")
+                child.restart_at = time.monotonic() + child.restart_delay
+                child.restart_delay = min(child.restart_delay * 2, MAX_RESTART_DELAY)
+            if time.monotonic() >= child.restart_at:
+                child.restart_at = None
+                child.start()
+            running += 1
+        if not running:
+            return failures
+        time.sleep(0.5)
+
+
+def fake_gateway(args, passthrough):
+    """Run benchmark.py once per process against the fake gateway and combine the reports."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as workdir:
+        def command(index, shard_ids):
+            return [
+                sys.executable, os.path.join(here, "benchmark.py"),
+                "--shard-count", str(args.shards), "--shard-ids", ",".join(map(str, shard_ids)),
+                "--workdir", workdir, "--json", os.path.join(workdir, f"results-{index}.json"), *passthrough,
+            ]
+        children = build_processes(args.shards, args.processes, command, dict(os.environ), 0)
+        started = time.perf_counter()
+        for child in children:
+            child.start()
+        failures = supervise(children, restart=False)
+        elapsed = time.perf_counter() - started
+
+        combined = {}
+        for child in children:
+            path = os.path.join(workdir, f"results-{child.index}.json")
+            if not os.path.exists(path):
+                continue
+            with open(path) as f:
+                for row in json.load(f):
+                    total = combined.setdefault(row["scenario"], {"ops": 0, "ops_per_second": 0.0, "p99_ms": 0.0, "max_lag_ms": 0.0})
+                    total["ops"] += row["ops"]
+                    total["ops_per_second"] += row["ops_per_second"]
+                    total["p99_ms"] = max(total["p99_ms"], row["p99_ms"])
+                    total["max_lag_ms"] = max(total["max_lag_ms"], row["max_lag_ms"])
+
+    print(f"\nCombined over {len(children)} processes and {args.shards} shards ({elapsed:.1f}s):")
+    print(f"{'scenario':<22}{'ops':>8}{'ops/s':>10}{'worst p99 ms':>14}{'max lag ms':>12}")
+    for name, total in combined.items():
+        print(f"{name:<22}{total['ops']:>8}{total['ops_per_second']:>10.1f}{total['p99_ms']:>14.2f}{total['max_lag_ms']:>12.1f}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--shards", type=int, help="Total shard count (default: Discord's recommendation)")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="Number of bot processes")
+    parser.add_argument("--metrics-port", type=int, default=int(os.getenv("METRICS_PORT", "9108")),
+                        help="Metrics port of the first process; the others use the following ports (0 disables)")
+    parser.add_argument("--fake-gateway", action="store_true", help="Run benchmark.py processes instead of connecting to Discord")
+    args, passthrough = parser.parse_known_args()
+    passthrough = [arg for arg in passthrough if arg != "--"]
+
+    if args.fake_gateway:
+        args.shards = args.shards or args.processes
+        sys.exit(1 if fake_gateway(args, passthrough) else 0)
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    max_concurrency = 1
+    if not args.shards:
+        args.shards, max_concurrency = recommended_shards(os.getenv("Discord_Bot_Token"))
+        print(f"📡 Discord recommends {args.shards} shards")
+    bot_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+    children = build_processes(
+        args.shards, args.processes, lambda index, shard_ids: [sys.executable, bot_path], dict(os.environ), args.metrics_port
+    )
+    start_staggered(children, max_concurrency)
+    sys.exit(1 if supervise(children) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import os
+
+
+def shard_for(guild_id, shard_count):
+    """Return the gateway shard Discord delivers a guild's events on."""
+    return (guild_id >> 22) % shard_count
+
+
+def partition(shard_count, processes):
+    """Split shard IDs into contiguous blocks, one per process, as evenly as possible."""
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+    blocks = []
+    start = 0
+    for index in range(processes):
+        end = start + size + (1 if index < extra else 0)
+        blocks.append(list(range(start, end)))
+        start = end
+    return blocks
+
+
+class ShardFilter:
+    """Tells whether a guild belongs to the shards this process runs."""
+
+    def __init__(self, shard_count=0, shard_ids=None):
+        self.shard_count = shard_count
+        self.shard_ids = frozenset(shard_ids) if shard_ids else None  # None means every shard
+
+    @classmethod
+    def from_env(cls):
+        """Build the filter from SHARD_COUNT and SHARD_IDS, as set by shardLauncher.py."""
+        shard_count = int(os.getenv("SHARD_COUNT", "0"))
+        shard_ids = [int(shard) for shard in os.getenv("SHARD_IDS", "").split(",") if shard.strip()]
+        return cls(shard_count, shard_ids)
+
+    @property
+    def sharded(self):
+        return self.shard_count > 0
+
+    def owns(self, guild_id):
+        """Return True if this process handles the guild's events and state."""
+        if not self.sharded or self.shard_ids is None:
+            return True
+        return shard_for(guild_id, self.shard_count) in self.shard_ids
+
+    def owns_shard(self, shard_id):
+        return self.shard_ids is None or shard_id in self.shard_ids
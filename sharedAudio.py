@@ -0,0 +1,190 @@
+import shlex
+import threading
+import subprocess
+import discord
+import metrics
+from discord.oggparse import OggStream
+
+# Same encoder settings discord.FFmpegOpusAudio uses, so frames can be sent to Discord as-is
+OPUS_OPTIONS = (
+    '-map_metadata', '-1', '-f', 'opus', '-c:a', 'libopus',
+    '-ar', '48000', '-ac', '2', '-b:a', '128k', '-loglevel', 'warning',
+)
+# Frames are 20ms each, so this keeps the last 45 seconds of audio per stream (well under 1MB)
+MAX_BUFFERED_FRAMES = 45 * 50
+# Once a stream is over budget, drop this many frames at a time from the front
+TRIM_FRAMES = 50
+# FFmpeg is kept at most this many frames ahead of the furthest reader, i.e. at playback speed
+LEAD_FRAMES = 5 * 50
+# A reader gives up on a stream that hasn't produced a frame for this long
+READ_TIMEOUT = 15
+
+
+class SharedStream:
+    """One FFmpeg process encoding a stream to Opus frames that any number of readers replay.
+
+    FFmpeg is paced to stay a few seconds ahead of the furthest reader, and only the
+    last max_frames frames are kept. A guild that starts the same song within that
+    window shares the decode from the beginning; once the first frame has been
+    dropped the stream takes no new readers, and later guilds start a stream of
+    their own. A reader that falls out of the window, e.g. while paused, skips ahead
+    to the oldest frame still kept.
+    """
+
+    def __init__(self, key, url, before_options=None, max_frames=MAX_BUFFERED_FRAMES, executable="ffmpeg"):
+        self.key = key
+        self.url = url
+        self.before_options = before_options
+        self.max_frames = max_frames
+        self.executable = executable
+        self.frames = []  # Encoded frames, frames[0] being frame number self.offset of the track
+        self.offset = 0
+        self.finished = False
+        self.closed = False
+        self.readers = set()
+        self._cond = threading.Condition()
+        self._process = None
+
+    def joinable(self):
+        """Return True if a new reader could still hear the track from the beginning."""
+        return self.offset == 0 and not self.closed
+
+    def add_reader(self, reader):
+        with self._cond:
+            self.readers.add(reader)
+
+    def remove_reader(self, reader):
+        """Forget a reader and return how many are left."""
+        with self._cond:
+            self.readers.discard(reader)
+            self._cond.notify_all()
+            return len(self.readers)
+
+    def _start(self):
+        """Launch FFmpeg and the thread that collects its frames; called with the lock held."""
+        args = [self.executable, *shlex.split(self.before_options or ''), '-i', self.url, *OPUS_OPTIONS, 'pipe:1']
+        self._process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+        threading.Thread(target=self._produce, name=f"shared-audio-{self.key}", daemon=True).start()
+
+    def _produce(self):
+        try:
+            for packet in OggStream(self._process.stdout).iter_packets():
+                with self._cond:
+                    while not self.closed and self._lead() >= LEAD_FRAMES:
+                        self._cond.wait(0.1)
+                    if self.closed:
+                        return
+                    self.frames.append(packet)
+                    if len(self.frames) > self.max_frames:
+                        del self.frames[:TRIM_FRAMES]
+                        self.offset += TRIM_FRAMES
+                    self._cond.notify_all()
+        except Exception as e:
+            print(f"Error decoding shared stream {self.key}: {e}")
+        finally:
+            with self._cond:
+                self.finished = True
+                self._cond.notify_all()
+
+    def _lead(self):
+        """Return how many frames the decode is ahead of the furthest reader; called with the lock held."""
+        furthest = max((reader.position for reader in self.readers), default=0)
+        return self.offset + len(self.frames) - furthest
+
+    def read(self, reader):
+        """Return the reader's next frame, waiting for FFmpeg if needed, or b'' at the end."""
+        with self._cond:
+            if self._process is None and not self.closed:
+                # The decode starts when the first listener pulls audio
+                self._start()
+            reader.position = max(reader.position, self.offset)
+            while reader.position - self.offset >= len(self.frames):
+                if self.finished or self.closed or not self._cond.wait(READ_TIMEOUT):
+                    return b''
+            frame = self.frames[reader.position - self.offset]
+            reader.position += 1
+            return frame
+
+    def close(self):
+        """Stop FFmpeg and drop the buffered frames."""
+        with self._cond:
+            self.closed = True
+            self.frames = []
+            self._cond.notify_all()
+        if self._process is not None:
+            try:
+                self._process.kill()
+                self._process.wait(timeout=5)
+            except Exception as e:
+                print(f"Error stopping shared stream {self.key}: {e}")
+
+
+class SharedAudioSource(discord.AudioSource):
+    """A voice client's own position in a SharedStream. Yields Opus frames, so nothing is re-encoded."""
+
+    def __init__(self, hub, stream):
+        self.hub = hub
+        self.stream = stream
+        self.position = 0  # Frame number within the track
+        self._released = False
+
+    def read(self):
+        return self.stream.read(self)
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        if not self._released:
+            self._released = True
+            self.hub.release(self)
+
+
+class SharedAudioHub:
+    """Hands out readers for shared streams, keyed by track, and closes streams nobody is listening to."""
+
+    def __init__(self, max_frames=MAX_BUFFERED_FRAMES, executable="ffmpeg"):
+        self.max_frames = max_frames
+        self.executable = executable
+        self._streams = {}  # key -> SharedStream new readers join
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._streams)
+
+    def listeners(self):
+        """Return how many voice clients are reading shared streams."""
+        with self._lock:
+            return sum(len(stream.readers) for stream in self._streams.values())
+
+    def open(self, key, url, before_options=None):
+        """Return an audio source for a track, sharing the decode with anyone already playing it."""
+        with self._lock:
+            stream = self._streams.get(key)
+            shared = stream is not None and stream.joinable()
+            if not shared:
+                # Readers of an older stream that is past its first frames keep it until they finish
+                stream = self._streams[key] = SharedStream(
+                    key, url, before_options, max_frames=self.max_frames, executable=self.executable
+                )
+            reader = SharedAudioSource(self, stream)
+            stream.add_reader(reader)
+        metrics.inc("shared_audio_opens_total", result="shared" if shared else "new")
+        return reader
+
+    def release(self, reader):
+        """Drop a reader; the stream is closed once nobody is listening to it."""
+        stream = reader.stream
+        with self._lock:
+            if stream.remove_reader(reader):
+                return
+            if self._streams.get(stream.key) is stream:
+                del self._streams[stream.key]
+        stream.close()
+
+    def close(self):
+        """Close every stream."""
+        with self._lock:
+            streams, self._streams = list(self._streams.values()), {}
+        for stream in streams:
+            stream.close()
@@ -0,0 +1,54 @@
+import unittest
+from messageChunks import FENCE, split_message
+
+
+class SplitMessageTest(unittest.TestCase):
+    def assertValidChunks(self, text, limit=2000):
+        chunks = split_message(text, limit)
+        for chunk in chunks:
+            self.assertLessEqual(len(chunk), limit)
+        # Every split closes its code block; only a block left open in the input stays open
+        for chunk in chunks[:-1]:
+            self.assertEqual(chunk.count(FENCE) % 2, 0, chunk)
+        if chunks:
+            self.assertEqual(chunks[-1].count(FENCE) % 2, text.count(FENCE) % 2)
+        return chunks
+
+    def test_short_text_is_one_chunk(self):
+        self.assertEqual(split_message("hello"), ["hello"])
+        self.assertEqual(split_message(""), [])
+
+    def test_prefers_paragraph_breaks(self):
+        text = "a" * 1500 + "\n\n" + "b" * 1500
+        self.assertEqual(self.assertValidChunks(text), ["a" * 1500, "b" * 1500])
+
+    def test_code_block_is_reopened_with_its_language(self):
+        chunks = self.assertValidChunks("```python\n" + "x = 1\n" * 800 + "```")
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks[1:]:
+            self.assertTrue(chunk.startswith("```python\n"))
+
+    def test_unbroken_code_block(self):
+        chunks = self.assertValidChunks(FENCE + "a" * 3000)
+        self.assertTrue(chunks[1].startswith(FENCE + "\n"))
+
+    def test_fence_not_followed_by_a_language(self):
+        chunks = self.assertValidChunks("Inline ```code``` then ``` " + "word " * 700)
+        self.assertTrue(chunks[1].startswith(FENCE + "\n"))
+
+    def test_long_text_after_a_fence_is_not_a_language(self):
+        chunks = self.assertValidChunks(FENCE + "not a language at all\n" + "line\n" * 600)
+        self.assertTrue(chunks[1].startswith(FENCE + "\n"))
+
+    def test_small_limits_finish(self):
+        for limit in (32, 33, 40, 64):
+            for text in (FENCE + "a" * 500, FENCE + "python3\n" + "b " * 300, "``` " * 200, "a ```b``` c ```\n" * 60):
+                self.assertValidChunks(text, limit)
+
+    def test_limit_too_small(self):
+        with self.assertRaises(ValueError):
+            split_message("a" * 100, 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+import time
+import asyncio
+import sqlite3
+import threading
+import yt_dlp
+import metrics
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+
+YDL_OPTS = {
+    'format': 'bestaudio/best',
+    'quiet': True,
+    'default_search': 'ytsearch',
+    'noplaylist': True,
+}
+
+# Used when a stream URL doesn't say when it expires
+DEFAULT_STREAM_TTL = 30 * 60
+# Keep this much headroom before a signed URL expires so FFmpeg can still reconnect
+EXPIRY_MARGIN = 60
+
+
+def stream_expiry(info, now=None):
+    """Return the wall-clock time after which a resolved stream URL shouldn't be used."""
+    now = time.time() if now is None else now
+    expire = parse_qs(urlparse(info['url']).query).get('expire')
+    try:
+        expires_at = int(expire[0]) if expire else now + DEFAULT_STREAM_TTL
+    except ValueError:
+        expires_at = now + DEFAULT_STREAM_TTL
+    # The URL has to stay valid for the whole song, not just until it starts
+    return expires_at - EXPIRY_MARGIN - (info.get('duration') or 0)
+
+
+class TrackResolver:
+    """Resolves queue entries to stream URLs in bounded thread pools and caches the results.
+
+    Prefetches share one pool. Songs needed right now get a small pool of their own,
+    so they never wait behind other guilds' prefetches.
+    """
+
+    def __init__(self, lookahead=3, workers=4, max_entries=256, search_cache=None, urgent_workers=2):
+        self.lookahead = lookahead
+        self.search_cache = search_cache  # Optional ResolveCache for ytsearch results
+        self.max_entries = max_entries
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="track-resolver")
+        self._urgent = ThreadPoolExecutor(max_workers=urgent_workers, thread_name_prefix="track-resolver-urgent")
+        self._cache = OrderedDict()  # query -> resolved track, oldest first
+        self._pending = {}  # query -> (Future, on demand) for lookups still in flight
+        self._lock = threading.RLock()  # Done callbacks can run inside _submit
+
+    def _cache_call(self, method, *args):
+        """Call a search cache method, treating database errors as a cache miss."""
+        try:
+            return method(*args)
+        except sqlite3.Error as e:
+            print(f"Error using the search cache: {e}")
+            return None
+
+    @staticmethod
+    def _ydl_extract(target):
+        with metrics.timed("external_call_seconds", service="yt-dlp"), yt_dlp.YoutubeDL(YDL_OPTS) as ydl:
+            info = ydl.extract_info(target, download=False)
+        if 'entries' in info:
+            info = info['entries'][0]
+        return info
+
+    def _extract(self, query):
+        """Blocking yt-dlp lookup for a single queue entry."""
+        # Free-text entries go through ytsearch; skip the search when we already know the video
+        is_search = not query.startswith(("http://", "https://"))
+        known = self._cache_call(self.search_cache.get, query) if is_search and self.search_cache else None
+        info = None
+        if known:
+            try:
+                info = self._ydl_extract(f"https://www.youtube.com/watch?v={known['video_id']}")
+            except yt_dlp.utils.DownloadError as e:
+                # The video may have been removed, made private or blocked since; search again
+                print(f"Cached video for {query!r} failed, searching again: {e}")
+                self._cache_call(self.search_cache.delete, query)
+                known = None
+        if info is None:
+            info = self._ydl_extract(query)
+
+        if is_search and known is None and self.search_cache:
+            self._cache_call(self.search_cache.put, query, info)
+        return {
+            'id': info.get('id'),
+            'url': info['url'],
+            'title': info.get('title', 'Unknown Title'),
+            'webpage_url': info.get('webpage_url', 'Unknown Link'),
+            'thumbnail': info.get('thumbnail', None),
+            'duration': info.get('duration'),
+            'expires_at': stream_expiry(info),
+        }
+
+    def _finished(self, query, future):
+        """Move a completed lookup from the pending table into the cache."""
+        with self._lock:
+            if self._pending.get(query, (None,))[0] is future:
+                del self._pending[query]
+            if future.cancelled() or future.exception() is not None:
+                return
+            self._cache[query] = future.result()
+            self._cache.move_to_end(query)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def _submit(self, query, urgent=False):
+        """Start resolving a query unless a lookup for it is already running."""
+        with self._lock:
+            future, was_urgent = self._pending.get(query, (None, False))
+            if future is not None and urgent and not was_urgent and future.cancel():
+                # It was still queued behind prefetches; move it to the on-demand pool
+                future = None
+            if future is None:
+                executor = self._urgent if urgent else self._executor
+                future = executor.submit(self._extract, query)
+                self._pending[query] = (future, urgent)
+                future.add_done_callback(lambda f: self._finished(query, f))
+            return future
+
+    def cached(self, query):
+        """Return a resolved track whose stream URL is still fresh, or None."""
+        with self._lock:
+            track = self._cache.get(query)
+            if track is None:
+                return None
+            if track['expires_at'] <= time.time():
+                del self._cache[query]
+                return None
+            self._cache.move_to_end(query)
+            return track
+
+    def prefetch(self, queries):
+        """Resolve upcoming queue entries in the background."""
+        for query in queries:
+            if self.cached(query) is None:
+                self._submit(query)
+
+    async def resolve(self, query):
+        """Return the resolved track for a query, waiting on the thread pool if needed."""
+        track = self.cached(query)
+        if track is not None:
+            return track
+        return await asyncio.wrap_future(self._submit(query, urgent=True))
+
+    def pending(self):
+        """Return how many lookups are queued or running."""
+        return len(self._pending)
+
+    def shutdown(self):
+        """Stop the worker threads, dropping lookups that haven't started."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._urgent.shutdown(wait=False, cancel_futures=True)
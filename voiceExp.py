@@ -0,0 +1,100 @@
+import time
+import asyncio
+
+
+def is_earning(voice_state, afk_channel):
+    """Return True if a member's voice state should accrue EXP."""
+    if voice_state is None or voice_state.channel is None:
+        return False
+    if afk_channel is not None and voice_state.channel.id == afk_channel.id:
+        return False
+    return not (voice_state.self_mute or voice_state.self_deaf or voice_state.mute or voice_state.deaf)
+
+
+class VoiceTimerWheel:
+    """Grants EXP for every full minute members spend in voice, using one timer for all guilds.
+
+    Members are spread over one slot per second of a minute-long wheel, based on
+    when they started earning. Each tick handles a single slot, so every member is
+    visited once a minute and the work per tick stays small however many people
+    are in voice.
+    """
+
+    def __init__(self, award, slots=60, tick=1.0):
+        self._award = award  # Coroutine function called as award(guild_id, user_ids)
+        self.slots = slots
+        self.tick = tick
+        self._wheel = [set() for _ in range(slots)]  # slot -> {(guild_id, user_id), ...}
+        self._members = {}  # (guild_id, user_id) -> slot
+        self._joining = set()  # Members whose slot hasn't come round since they were tracked
+        self._position = 0
+        self._task = None
+
+    def __len__(self):
+        return len(self._members)
+
+    def track(self, guild_id, user_id):
+        """Start accruing EXP for a member, unless they already are."""
+        key = (guild_id, user_id)
+        if key in self._members:
+            return
+        # The hand reaches this slot within a tick, which only ends the joining pass;
+        # the first award comes a full turn after that
+        slot = self._position
+        self._wheel[slot].add(key)
+        self._members[key] = slot
+        self._joining.add(key)
+
+    def untrack(self, guild_id, user_id):
+        """Stop accruing EXP for a member."""
+        slot = self._members.pop((guild_id, user_id), None)
+        if slot is not None:
+            self._wheel[slot].discard((guild_id, user_id))
+            self._joining.discard((guild_id, user_id))
+
+    def untrack_guild(self, guild_id):
+        """Stop accruing EXP for everyone in a guild."""
+        for key in [key for key in self._members if key[0] == guild_id]:
+            self.untrack(*key)
+
+    def clear(self):
+        """Stop accruing EXP for everyone."""
+        for slot in self._wheel:
+            slot.clear()
+        self._members.clear()
+        self._joining.clear()
+
+    def start(self):
+        """Start turning the wheel on the running event loop."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        """Stop turning the wheel."""
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        next_tick = time.monotonic()
+        while True:
+            next_tick += self.tick
+            await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+            await self.advance()
+
+    async def advance(self):
+        """Move the hand one slot and award everyone in that slot a minute of EXP."""
+        slot = self._wheel[self._position]
+        self._position = (self._position + 1) % self.slots
+        if not slot:
+            return
+        guilds = {}
+        for key in slot:
+            if key in self._joining:
+                self._joining.discard(key)
+                continue
+            guilds.setdefault(key[0], []).append(key[1])
+        for guild_id, user_ids in guilds.items():
+            try:
+                await self._award(guild_id, user_ids)
+            except Exception as e:
+                print(f"Error awarding voice EXP in guild {guild_id}: {e}")
@@ -1,11 +1,131 @@
+import time
+import random
+import asyncio
+import requests
 import wikipedia
+import metrics
+from collections import deque
+
+API_URL = "https://en.wikipedia.org/w/api.php"
+USER_AGENT = "Discord-Bot (random-wiki-article)"
 
 def randomWikiGen():
-    random_title = wikipedia.random()
+    with metrics.timed("external_call_seconds", service="wikipedia"):
+        random_title = wikipedia.random()
     try:
-        page = wikipedia.page(random_title)
+        with metrics.timed("external_call_seconds", service="wikipedia"):
+            page = wikipedia.page(random_title)
         return f"**{page.title}**\n{page.summary[:300]}...\nRead more: {page.url}"
     except wikipedia.exceptions.DisambiguationError as e:
         return f"Too many results for **{random_title}**. Try searching directly: https://en.wikipedia.org/wiki/{random_title.replace(' ', '_')}"
     except wikipedia.exceptions.PageError:
-        return "Couldn't find a valid Wikipedia article. Try again!"
\ No newline at end of file
+        return "Couldn't find a valid Wikipedia article. Try again!"
+
+def formatArticle(article):
+    """Format an article summary from an ArticlePool for Discord."""
+    return f"**{article['title']}**\n{article['summary'][:300]}...\nRead more: {article['url']}"
+
+class MediaWikiSource:
+    """Fetches random article summaries from the MediaWiki API, many per request."""
+
+    # The API returns at most this many intro extracts per request
+    MAX_BATCH = 20
+
+    def __init__(self, api_url=API_URL):
+        self.api_url = api_url
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+
+    def fetch(self, count):
+        """Return up to count random articles, skipping disambiguation pages. Blocking."""
+        params = {
+            "action": "query",
+            "format": "json",
+            "generator": "random",
+            "grnnamespace": 0,
+            "grnlimit": min(count, self.MAX_BATCH),
+            "prop": "extracts|info|pageprops",
+            "exintro": 1,
+            "explaintext": 1,
+            "exlimit": "max",
+            "inprop": "url",
+            "ppprop": "disambiguation",
+        }
+        with metrics.timed("external_call_seconds", service="wikipedia"):
+            response = self.session.get(self.api_url, params=params, timeout=10)
+        response.raise_for_status()
+        pages = response.json().get("query", {}).get("pages", {}).values()
+        articles = []
+        for page in pages:
+            if "disambiguation" in page.get("pageprops", {}) or not page.get("extract"):
+                continue
+            articles.append({"title": page["title"], "summary": page["extract"], "url": page["fullurl"]})
+        return articles
+
+class FakeWikiSource:
+    """Local stand-in for MediaWikiSource that makes up articles, for tests and benchmarks."""
+
+    def __init__(self, latency=0.0, disambiguation_rate=0.1):
+        self.latency = latency
+        self.disambiguation_rate = disambiguation_rate
+        self.requests = 0
+        self._next_id = 0
+
+    def fetch(self, count):
+        """Return up to count made-up articles after a fixed delay. Blocking."""
+        self.requests += 1
+        time.sleep(self.latency)
+        articles = []
+        for _ in range(count):
+            self._next_id += 1
+            # Disambiguation pages are dropped just like the real source does
+            if random.random() < self.disambiguation_rate:
+                continue
+            title = f"Article {self._next_id}"
+            articles.append({
+                "title": title,
+                "summary": f"{title} is an article made up for testing.",
+                "url": f"https://en.wikipedia.org/wiki/{title.replace(' ', '_')}",
+            })
+        return articles
+
+class ArticlePool:
+    """Keeps validated random articles in memory so they can be handed out instantly.
+
+    Whenever the pool drops below low_water it is topped back up to size in the
+    background, with the blocking source calls running in a worker thread.
+    """
+
+    def __init__(self, source, size=20, low_water=5):
+        self.source = source
+        self.size = size
+        self.low_water = low_water
+        self._articles = deque()
+        self._refill_task = None
+
+    def __len__(self):
+        return len(self._articles)
+
+    def take(self):
+        """Return a pooled article, or None if the pool is empty, and top the pool up if needed."""
+        article = self._articles.popleft() if self._articles else None
+        self.refill()
+        return article
+
+    def refill(self):
+        """Start a background refill if the pool is low and one isn't already running."""
+        if len(self._articles) >= self.low_water:
+            return
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill())
+
+    async def _refill(self):
+        while len(self._articles) < self.size:
+            try:
+                articles = await asyncio.to_thread(self.source.fetch, self.size - len(self._articles))
+            except Exception as e:
+                print(f"Error refilling Wikipedia article pool: {e}")
+                return
+            if not articles:
+                return
+            self._articles.extend(articles)